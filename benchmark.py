@@ -0,0 +1,323 @@
+"""Load test for print_server.py against a local fake raw-9100 printer.
+
+Starts a TCP stand-in for a QL/PT printer, drives /label (or the bulk /labels
+endpoint) with concurrent clients and reports labels/s, latency percentiles
+and the server's CPU and memory use. Runs headless on Linux, no printer needed.
+
+    python benchmark.py --requests 2000 --clients 16
+    python benchmark.py --bulk 50 --accept-delay 0.05 --failure-rate 0.01
+    python benchmark.py --url http://label-host:3000 --server-pid 1234
+"""
+import argparse
+import json
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+RUN_ID = uuid.uuid4().hex[:8]
+DEFAULT_SERVER_CMD = f"{shlex.quote(sys.executable)} print_server.py --headless --no-spool --port {{port}}"
+
+class FakePrinter:
+    # Accepts raw-9100 connections like a QL-820NWB and discards the label data
+    def __init__(self, host='127.0.0.1', port=0, accept_delay=0.0, bandwidth=0, failure_rate=0.0):
+        self.accept_delay = accept_delay
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.failures = 0
+        self.bytes_received = 0
+        self.labels_received = 0
+        self.server = socket.create_server((host, port), backlog=128)
+        self.address = self.server.getsockname()
+        self.running = True
+
+    def start(self):
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.server.close()
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        with conn:
+            if self.accept_delay:
+                time.sleep(self.accept_delay)
+            with self.lock:
+                self.connections += 1
+                fail = random.random() < self.failure_rate
+                if fail:
+                    self.failures += 1
+            if fail:
+                # Reset instead of a clean close, like a printer that drops the job
+                conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, b'\x01\x00\x00\x00\x00\x00\x00\x00')
+                return
+
+            tail = b''
+            while self.running:
+                try:
+                    data = conn.recv(65536)
+                except OSError:
+                    return
+                if not data:
+                    return
+                if self.bandwidth:
+                    time.sleep(len(data) / self.bandwidth)
+                # ^XZ ends every label, keep the last bytes in case it spans two reads
+                chunk = tail + data
+                with self.lock:
+                    self.bytes_received += len(data)
+                    self.labels_received += chunk.count(b'^XZ')
+                tail = chunk[-2:] if not chunk.endswith(b'^XZ') else b''
+
+class ProcessSampler:
+    # Samples CPU time and resident memory of the server process and its
+    # children (the --workers processes) from /proc
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.running = False
+        self.ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    @staticmethod
+    def stat(pid):
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                return f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            return None
+
+    def pids(self):
+        pids = [self.pid]
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                fields = self.stat(entry)
+                if fields and int(fields[1]) == self.pid:
+                    pids.append(int(entry))
+        return pids
+
+    def cpu_seconds(self):
+        # A worker that exits mid-run takes its CPU time with it
+        fields = [self.stat(pid) for pid in self.pids()]
+        if fields[0] is None:
+            return None
+        return sum(int(stat[11]) + int(stat[12]) for stat in fields if stat) / self.ticks
+
+    def rss_bytes(self):
+        total = 0
+        for pid in self.pids():
+            try:
+                with open(f'/proc/{pid}/status') as f:
+                    for line in f:
+                        if line.startswith('VmRSS:'):
+                            total += int(line.split()[1]) * 1024
+            except (OSError, ValueError):
+                pass
+        return total or None
+
+    def sample(self):
+        while self.running:
+            rss = self.rss_bytes()
+            if rss:
+                self.peak_rss = max(self.peak_rss, rss)
+            time.sleep(self.interval)
+
+    def start(self):
+        self.running = True
+        self.cpu_start = self.cpu_seconds()
+        self.wall_start = time.perf_counter()
+        threading.Thread(target=self.sample, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        cpu_end = self.cpu_seconds()
+        wall = time.perf_counter() - self.wall_start
+        if self.cpu_start is None or cpu_end is None:
+            return {"cpu_percent": None, "peak_rss_mb": None}
+        return {
+            "cpu_percent": round((cpu_end - self.cpu_start) / wall * 100, 1),
+            "peak_rss_mb": round(self.peak_rss / (1024 * 1024), 1) if self.peak_rss else None
+        }
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_for_server(url, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url + '/', timeout=1):
+                return True
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.1)
+    return False
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def label_request(url, printer, index, wait):
+    # A key per run and request, so the server's retry dedupe never answers
+    # from an earlier run against the same --url
+    query = {"PRINTER": printer, "SN": f"BENCH{index:08d}", "MODEL": "QL-820NWB",
+             "Model_APN": "APN-0000", "TYPE": "Benchmark", "MODE": "IP",
+             "IDEMPOTENCY_KEY": f"bench-{RUN_ID}-{index}"}
+    if wait:
+        query["WAIT"] = "1"
+    return urllib.request.Request(f"{url}/label?{urllib.parse.urlencode(query)}")
+
+def bulk_request(url, printer, index, size):
+    labels = [{"SN": f"BENCH{index * size + offset:08d}", "MODEL": "QL-820NWB",
+               "Model_APN": "APN-0000", "TYPE": "Benchmark"} for offset in range(size)]
+    body = json.dumps({"PRINTER": printer, "MODE": "IP", "labels": labels}).encode('utf-8')
+    return urllib.request.Request(f"{url}/labels", data=body, method='POST',
+                                  headers={"Content-Type": "application/json"})
+
+def run_load(url, printer, requests, clients, bulk, wait, first=0):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def one(index):
+        req = bulk_request(url, printer, index, bulk) if bulk else label_request(url, printer, index, wait)
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                response.read()
+            ok = True
+        except urllib.error.HTTPError as e:
+            ok = False
+            error = f"HTTP {e.code}"
+        except (urllib.error.URLError, OSError) as e:
+            ok = False
+            error = str(e)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors.append(error)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(one, range(first, first + requests)))
+    return time.perf_counter() - started, sorted(latencies), errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark print_server.py against a fake raw-9100 printer")
+    parser.add_argument('--url', help="Use an already running server instead of starting one")
+    parser.add_argument('--server-cmd', default=DEFAULT_SERVER_CMD,
+                        help="Command that starts the server, {port} is replaced with a free port")
+    parser.add_argument('--server-pid', type=int, help="PID to sample CPU/memory from when --url is used")
+    parser.add_argument('--requests', type=int, default=500, help="HTTP requests to send")
+    parser.add_argument('--clients', type=int, default=8, help="Concurrent HTTP clients")
+    parser.add_argument('--bulk', type=int, default=0, help="Labels per POST /labels request (0 uses /label)")
+    parser.add_argument('--no-wait', action='store_true',
+                        help="Measure /label acceptance only instead of waiting for each label to print")
+    parser.add_argument('--warmup', type=int, default=20, help="Requests sent before measuring")
+    parser.add_argument('--accept-delay', type=float, default=0.0, help="Fake printer delay per connection (s)")
+    parser.add_argument('--bandwidth', type=int, default=0, help="Fake printer bytes/s (0 is unlimited)")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Fraction of connections the printer resets")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    printer = FakePrinter(accept_delay=args.accept_delay, bandwidth=args.bandwidth,
+                          failure_rate=args.failure_rate).start()
+    printer_address = f"{printer.address[0]}:{printer.address[1]}"
+
+    server = None
+    if args.url:
+        url = args.url.rstrip('/')
+        server_pid = args.server_pid
+    else:
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        command = shlex.split(args.server_cmd.format(port=port))
+        server = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        server_pid = server.pid
+
+    try:
+        if not wait_for_server(url):
+            print(f"Server at {url} did not come up", file=sys.stderr)
+            return 1
+
+        wait = not args.no_wait
+        if args.warmup:
+            run_load(url, printer_address, args.warmup, args.clients, args.bulk, wait)
+
+        labels_before = printer.labels_received
+        sampler = ProcessSampler(server_pid).start() if server_pid else None
+        # Measured requests carry new serial numbers, never ones the warmup sent
+        elapsed, latencies, errors = run_load(url, printer_address, args.requests, args.clients, args.bulk, wait,
+                                              first=args.warmup)
+        usage = sampler.stop() if sampler else {"cpu_percent": None, "peak_rss_mb": None}
+        if not wait:
+            # Give queued jobs a moment to drain so the printer-side count is meaningful
+            time.sleep(1)
+
+        labels = args.requests * (args.bulk or 1) - (len(errors) * (args.bulk or 1))
+        report = {
+            "endpoint": "/labels" if args.bulk else "/label",
+            "requests": args.requests,
+            "clients": args.clients,
+            "errors": len(errors),
+            "elapsed_s": round(elapsed, 3),
+            "requests_per_s": round(args.requests / elapsed, 1),
+            "labels_per_s": round(labels / elapsed, 1),
+            "labels_received": printer.labels_received - labels_before,
+            "printer_connections": printer.connections,
+            "latency_ms": {
+                name: round(percentile(latencies, pct) * 1000, 2) if latencies else None
+                for name, pct in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))
+            },
+            "server": usage
+        }
+    finally:
+        if server:
+            server.terminate()
+            try:
+                server.wait(5)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        printer.stop()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{report['endpoint']}: {args.requests} requests, {args.clients} clients, {report['errors']} errors")
+        print(f"  throughput  {report['labels_per_s']} labels/s ({report['requests_per_s']} req/s)")
+        latency = report['latency_ms']
+        print(f"  latency     p50 {latency['p50']} ms  p95 {latency['p95']} ms  p99 {latency['p99']} ms  max {latency['max']} ms")
+        print(f"  printer     {report['labels_received']} labels over {report['printer_connections']} connections")
+        print(f"  server      cpu {usage['cpu_percent']}%  peak rss {usage['peak_rss_mb']} MB")
+        if errors:
+            print(f"  first error {errors[0]}")
+    return 0 if not errors else 2
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,27 +1,73 @@
-from flask import Flask, request, jsonify
+import time
+import_started = time.perf_counter()
+
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import socket
+import json
+import hashlib
+import csv
+import string
+import re
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from datetime import datetime
-from urllib.parse import parse_qs, urlparse
-import pystray
-from PIL import Image, ImageDraw, ImageFont
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import argparse
 import threading
+import multiprocessing
+import mmap
+import struct
+import zlib
+import bisect
+import functools
+import atexit
+import itertools
+import queue
+import uuid
+import select
 import os
 import sys
-import winreg
-import ctypes
-import requests
-import urllib.parse
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('printer_server2.log'),
-        logging.StreamHandler()
-    ]
-)
+
+# pystray, PIL, winreg and ctypes are only needed for the Windows tray and
+# startup entry and are imported there, so --headless runs anywhere
+import_seconds = time.perf_counter() - import_started
+startup_seconds = None
+
+# Logging
+LOG_FILE = 'printer_server2.log'
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+LOG_PAYLOADS = False           # Opt-in: log label bodies at DEBUG level
+LOG_PAYLOAD_LIMIT = 200        # Bytes of each logged label body
+LOG_PAYLOAD_SAMPLE = 1         # Log every Nth label body
+
+def setup_logging():
+    # Request threads only put records on a queue; a background listener does
+    # the formatting and the file/console I/O
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+    file_handler.setFormatter(formatter)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG if LOG_PAYLOADS else logging.INFO)
+    root.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+log_listener = setup_logging()
+payload_counter = itertools.count()
+
+def log_payload(printer, data):
+    if not LOG_PAYLOADS or next(payload_counter) % LOG_PAYLOAD_SAMPLE:
+        return
+    logging.debug("Label payload for %s (%d bytes): %r", printer, len(data), data[:LOG_PAYLOAD_LIMIT])
 
 app = Flask(__name__)
 CORS(app)
@@ -29,59 +75,1604 @@ server_running = True
 connection_type = "IP"
 
 TEMPLATES = {
-    '5': {'size': '62mm', 'dpi': '300x300'},  # Network QL series
-    '1': {'size': '36mm', 'dpi': '300x300'},  # USB PT-9xx series
-    '2': {'size': '24mm', 'dpi': '300x300'}   # USB PT-7xx and/or PT-9xx series
+    '5': {'size': '62mm', 'dpi': '300x300', 'layout': 'ql'},  # Network QL series
+    '1': {'size': '36mm', 'dpi': '360x360', 'layout': 'ql'},  # USB PT-9xx series
+    '2': {'size': '24mm', 'dpi': '180x180', 'layout': 'ql'}   # USB PT-7xx and/or PT-9xx series
+}
+
+APP_DIR = os.path.dirname(sys.executable if getattr(sys, 'frozen', False) else os.path.abspath(__file__))
+TEMPLATES_FILE = os.path.join(APP_DIR, 'print_server_templates.json')
+FIELD_ESCAPES = str.maketrans({'^': ' ', '~': ' ', '\n': ' ', '\r': ' '})
+FIELD_SPECIALS = re.compile('[\\^~\\r\\n]')
+
+# Printer profiles, keyed by series and first model digit so 'PT-7' covers the
+# PT-P700, PT-P710BT and PT-P750W. 'template' picks the label format in TEMPLATES,
+# which holds the tape size and dpi. More can be added under "profiles" in
+# print_server_templates.json.
+PRINTER_PROFILES = {
+    'QL-8': {'template': '5'},
+    'PT-9': {'template': '1'},
+    'PT-7': {'template': '2'}
+}
+DEFAULT_PROFILE = 'QL-8'
+PRINTER_MODEL = re.compile(r'\b(QL|PT)-?P?(\d)\d{2,3}', re.IGNORECASE)
+PROFILE_PROBE = False          # Ask network printers without a model in PRINTER for it over SNMP
+PROFILE_CACHE_SIZE = 1024      # Printer strings whose resolved profile is remembered
+
+# Pooled printer connections
+PRINTER_CONNECT_TIMEOUT = 5
+PRINTER_IDLE_TIMEOUT = 30      # Seconds before an unused socket is closed
+PRINTER_MAX_CONNECTIONS = 2    # Concurrent sockets per printer
+
+# Printer health probing
+PROBE_INTERVAL = 10            # Seconds between TCP connect probes
+PROBE_TIMEOUT = 1
+BREAKER_FAILURE_THRESHOLD = 3  # Consecutive failures before a printer is marked down
+BREAKER_RESET_TIMEOUT = 30     # Seconds before a down printer gets a trial job
+PRINTER_HEALTH_EXPIRY = 3600   # Seconds without a job before a printer is no longer probed
+OFFLINE_PARK_TIMEOUT = 0       # Seconds queued jobs wait for a down printer (0 fails them at once)
+
+# Printer groups
+PRINTER_GROUPS_FILE = os.path.join(APP_DIR, 'printer_groups.json')
+GROUP_PREFIX = 'group:'
+LATENCY_EWMA_ALPHA = 0.3       # Weight of the newest send time in a member's latency
+
+# Print job queue
+JOB_HISTORY = 1000             # Finished jobs kept for /jobs/<id>
+LABEL_WAIT_TIMEOUT = 15        # Seconds /label?WAIT=1 blocks for the outcome
+IDEMPOTENCY_TTL = 120          # Seconds a repeated /label is treated as a retry
+IDEMPOTENCY_CACHE_SIZE = 1000  # Recent labels kept for retries
+REPRINT_TTL = 24 * 3600        # Seconds a printed label can be resent with /reprint
+REPRINT_CACHE_SIZE = 1000      # Recent labels kept for /reprint
+IMPORT_CHUNK_SIZE = 50         # Labels rendered ahead and sent per connection checkout on import
+COALESCE_WINDOW = 0            # Seconds to gather jobs for one printer into a batch (0 disables)
+COALESCE_MAX_BATCH = 20        # Most jobs sent in one coalesced batch
+
+# Metrics
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRIC_HELP = {
+    'printer_connect_seconds': "Time to open a TCP connection to the printer",
+    'printer_send_seconds': "Time to write one label to the printer",
+    'printer_bytes_sent_total': "Label bytes written to the printer",
+    'printer_jobs_total': "Print jobs by result (succeeded, failed, timed_out, rejected)",
+    'printer_in_flight': "Print jobs currently being sent",
+    'printer_queue_depth': "Print jobs waiting in the printer's queue",
+    'http_request_seconds': "Time spent handling an HTTP request",
+    'http_requests_total': "HTTP requests by route and response code"
+}
+
+# Server-Sent Events (/events)
+EVENT_HISTORY = 500            # Recent events replayed to clients reconnecting with Last-Event-ID
+EVENT_QUEUE_SIZE = 100         # Events buffered per client before a slow client is dropped
+EVENT_KEEPALIVE = 15           # Seconds between keep-alive comments on an idle stream
+EVENT_MAX_SUBSCRIBERS = 4      # Each open stream holds a server thread, keep below SERVER_THREADS
+
+# Durable print spool
+SPOOL_ENABLED = True
+SPOOL_FILE = os.path.join(APP_DIR, 'print_spool.dat')
+SPOOL_FSYNC = False            # fsync every record (slower, survives power loss)
+SPOOL_COMPACT_INTERVAL = 60
+SPOOL_COMPACT_MIN_BYTES = 1024 * 1024
+SPOOL_FAILED_RETENTION = 7 * 24 * 3600  # Seconds a failed job stays spooled for /jobs/<id>/retry
+
+# HTTP serving
+SERVER_MODE = 'waitress'       # 'waitress' (production WSGI) or 'dev' (Flask development server)
+SERVER_HOST = '0.0.0.0'
+SERVER_PORT = 3000
+SERVER_THREADS = 8
+SERVER_KEEP_ALIVE = 30
+SERVER_CONNECTION_LIMIT = 100
+SERVER_BACKLOG = 1024
+SERVER_WORKERS = 1             # HTTP worker processes, more than one needs Linux and waitress
+WORKER_RESTART_DELAY = 1       # Seconds between checks for crashed workers
+
+# Label layouts are plain str.format templates; the static parts are encoded
+# once in compile_label_templates() and only the field values are encoded per
+# label. Extra layouts and printer templates can be added without code edits in
+# print_server_templates.json next to the executable:
+#   {"layouts": {"name": "...{serial_number}..."},
+#    "templates": {"7": {"size": "29mm", "dpi": "300x300", "layout": "name"}}}
+LABEL_LAYOUTS = {
+    'ql': ("%-12345X@PJL ENTER LANGUAGE=PCL\n"
+           "!12355FQL-820NWB\n"
+           "!1B 1D 72 {template_format}\n"
+           # SN text and barcode
+           "^FO20,20^A0N,30,30^FDSN:^FS\n"
+           "^FO100,20^BCN,100,Y,N,N^FD{serial_number}^FS\n"
+           # Model heading
+           "^FO20,150^A0N,30,30^FDModel^FS\n"
+           "^FO20,190^A0N,35,35^FD{model}^FS\n"
+           # APN heading and value
+           "^FO20,240^A0N,30,30^FDAPN^FS\n"
+           "^FO20,280^A0N,35,35^FD{model_apn}^FS\n"
+           # QR code on the right
+           "^FO450,240^BQN,2,4^FD{serial_number}^FS\n"
+           # Type heading and value
+           "^FO20,330^A0N,30,30^FDType:^FS\n"
+           "^FO20,370^A0N,35,35^FD{type_name}^FS\n"
+           "^XZ")
 }
 
+class LabelTemplate:
+    def __init__(self, source):
+        # The layout is compiled into one bytes %-format with a %b slot per field
+        pattern = []
+        self.fields = []
+        for literal, field, _, _ in string.Formatter().parse(source):
+            pattern.append(literal.encode('utf-8').replace(b'%', b'%%'))
+            if field is not None:
+                pattern.append(b'%b')
+                self.fields.append(field)
+        self.pattern = b''.join(pattern)
+
+    def render(self, fields):
+        values = [str(fields.get(name, '')) for name in self.fields]
+        # ^ and ~ start ZPL commands and would break the label if left in a field
+        if FIELD_SPECIALS.search('\0'.join(values)):
+            values = [value.translate(FIELD_ESCAPES) for value in values]
+        return self.pattern % tuple([value.encode('utf-8') for value in values])
+
+def load_label_templates(path=TEMPLATES_FILE):
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        LABEL_LAYOUTS.update(config.get('layouts', {}))
+        TEMPLATES.update(config.get('templates', {}))
+        PRINTER_PROFILES.update(config.get('profiles', {}))
+        logging.info(f"Loaded label templates from {path}")
+    except Exception as e:
+        logging.error(f"Failed to load label templates from {path}: {str(e)}")
+
+def compile_label_templates():
+    layouts = {name: LabelTemplate(source) for name, source in LABEL_LAYOUTS.items()}
+    return {format_type: layouts[template.get('layout', 'ql')]
+            for format_type, template in TEMPLATES.items()}
+
 def create_label_data(template_format, serial_number, model, model_apn, type_name, username, date):
-    return (f"%-12345X@PJL ENTER LANGUAGE=PCL\n"
-            f"!12355FQL-820NWB\n"
-            f"!1B 1D 72 {template_format}\n"
-            # SN text and barcode
-            f"^FO20,20^A0N,30,30^FDSN:^FS\n"
-            f"^FO100,20^BCN,100,Y,N,N^FD{serial_number}^FS\n"
-            # Model heading
-            f"^FO20,150^A0N,30,30^FDModel^FS\n"
-            f"^FO20,190^A0N,35,35^FD{model}^FS\n"
-            # APN heading and value
-            f"^FO20,240^A0N,30,30^FDAPN^FS\n"
-            f"^FO20,280^A0N,35,35^FD{model_apn}^FS\n"
-            # QR code on the right
-            f"^FO450,240^BQN,2,4^FD{serial_number}^FS\n"
-            # Type heading and value
-            f"^FO20,330^A0N,30,30^FDType:^FS\n"
-            f"^FO20,370^A0N,35,35^FD{type_name}^FS\n"
-            f"^XZ")
-
-def send_to_network_printer(printer_ip, data):
-    try:
-        printer_port = 9100
-        if ':' in printer_ip:
-            printer_ip, port = printer_ip.split(':')
-            printer_port = int(port)
-
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(5)
-            s.connect((printer_ip, printer_port))
-            logging.info(f"Connection successful to {printer_ip}:{printer_port}")
-            
-            s.sendall(data.encode('utf-8'))
-            logging.info(f"Sentent data: {data}")
-            
-            logging.info("Print job sent successfully")
+    template = label_templates.get(template_format, label_templates['5'])
+    return template.render({
+        'template_format': template_format,
+        'serial_number': serial_number,
+        'model': model,
+        'model_apn': model_apn,
+        'type_name': type_name,
+        'username': username,
+        'date': date
+    })
+
+def parse_printer_address(printer_ip):
+    printer_port = 9100
+    if ':' in printer_ip:
+        printer_ip, port = printer_ip.split(':')
+        printer_port = int(port)
+    return printer_ip, printer_port
+
+def model_key(text):
+    match = PRINTER_MODEL.search(text)
+    return f"{match.group(1).upper()}-{match.group(2)}" if match else None
+
+def snmp_get_request(oid, community=b'public'):
+    # SNMP v1 GetRequest, every part here is short enough for one-byte lengths
+    def tlv(tag, value):
+        return bytes([tag, len(value)]) + value
+    name = tlv(0x06, bytes([oid[0] * 40 + oid[1], *oid[2:]]))
+    varbinds = tlv(0x30, tlv(0x30, name + b'\x05\x00'))
+    pdu = tlv(0xa0, tlv(0x02, b'\x01') + tlv(0x02, b'\x00') + tlv(0x02, b'\x00') + varbinds)
+    return tlv(0x30, tlv(0x02, b'\x00') + tlv(0x04, community) + pdu)
+
+# hrDeviceDescr.1, which Brother printers fill with e.g. "Brother QL-820NWB"
+SNMP_MODEL_REQUEST = snmp_get_request((1, 3, 6, 1, 2, 1, 25, 3, 2, 1, 3, 1))
+
+def probe_printer_model(printer_ip):
+    try:
+        host, _ = parse_printer_address(printer_ip)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.settimeout(PROBE_TIMEOUT)
+            s.sendto(SNMP_MODEL_REQUEST, (host, 161))
+            return s.recv(1500).decode('latin-1')
+    except (OSError, ValueError) as e:
+        logging.info(f"Could not read the model of printer {printer_ip}: {str(e)}")
+        return ''
+
+resolved_profiles = OrderedDict()
+
+def printer_profile(mode, printer_connection):
+    # Resolved once per printer string, later lookups are a single dict hit
+    profile = resolved_profiles.get((mode, printer_connection))
+    if profile is not None:
+        return profile
+
+    if printer_connection.startswith(GROUP_PREFIX):
+        # Group members share a tape size, so the first one stands in for all
+        members = printer_groups.members(printer_connection[len(GROUP_PREFIX):])
+        profile = printer_profile(mode, members[0]) if members else None
+        if profile is None:
+            return {'model': DEFAULT_PROFILE, **PRINTER_PROFILES[DEFAULT_PROFILE]}
+    else:
+        model = model_key(printer_connection)
+        if model is None and mode == 'IP' and PROFILE_PROBE:
+            description = probe_printer_model(printer_connection)
+            if not description:
+                # Try again next time instead of pinning an unreachable printer to the default
+                return {'model': DEFAULT_PROFILE, **PRINTER_PROFILES[DEFAULT_PROFILE]}
+            model = model_key(description)
+        if model not in PRINTER_PROFILES:
+            model = DEFAULT_PROFILE
+        profile = {'model': model, **PRINTER_PROFILES[model]}
+    resolved_profiles[(mode, printer_connection)] = profile
+    if len(resolved_profiles) > PROFILE_CACHE_SIZE:
+        resolved_profiles.popitem(last=False)
+    return profile
+
+def resolve_format_type(mode, printer_connection):
+    return printer_profile(mode, printer_connection)['template']
+
+class Histogram:
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    # Counters, gauges and latency histograms keyed by metric name and labels,
+    # exported in Prometheus text format or JSON by /metrics
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_gauge(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def in_flight(self, **labels):
+        self.add_gauge('printer_in_flight', 1, **labels)
+        try:
+            yield
+        finally:
+            self.add_gauge('printer_in_flight', -1, **labels)
+
+    @staticmethod
+    def format_labels(labels, extra=()):
+        labels = list(labels) + list(extra)
+        if not labels:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                   for _, value in labels)
+        return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+    def snapshot(self, gauges=None):
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = {**self.gauges, **(gauges or {})}
+            histograms = {key: (list(h.buckets), list(h.counts), h.sum, h.count)
+                          for key, h in self.histograms.items()}
+        return counters, gauges, histograms
+
+    @staticmethod
+    def merge(*snapshots):
+        # Adds up the snapshots of several processes series by series
+        counters, gauges, histograms = {}, {}, {}
+        for snapshot_counters, snapshot_gauges, snapshot_histograms in snapshots:
+            for merged, values in ((counters, snapshot_counters), (gauges, snapshot_gauges)):
+                for key, value in values.items():
+                    merged[key] = merged.get(key, 0) + value
+            for key, (buckets, counts, total, count) in snapshot_histograms.items():
+                previous = histograms.get(key)
+                if previous is not None:
+                    counts = [a + b for a, b in zip(previous[1], counts)]
+                    total += previous[2]
+                    count += previous[3]
+                histograms[key] = (buckets, counts, total, count)
+        return counters, gauges, histograms
+
+    def prometheus(self, snapshot):
+        counters, gauges, histograms = snapshot
+        lines = []
+        for metric_type, values in (('counter', counters), ('gauge', gauges)):
+            for name in sorted({name for name, _ in values}):
+                lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f"{name}{self.format_labels(labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(list(buckets) + ['+Inf'], counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{self.format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{self.format_labels(labels)} {total}")
+                lines.append(f"{name}_count{self.format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self, snapshot):
+        counters, gauges, histograms = snapshot
+
+        def series(values):
+            result = {}
+            for (name, labels), value in sorted(values.items()):
+                result.setdefault(name, []).append({"labels": dict(labels), "value": value})
+            return result
+
+        histogram_series = {}
+        for (name, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+            histogram_series.setdefault(name, []).append({
+                "labels": dict(labels),
+                "buckets": dict(zip([str(bound) for bound in buckets] + ['+Inf'], counts)),
+                "sum": total,
+                "count": count
+            })
+        return {"counters": series(counters), "gauges": series(gauges), "histograms": histogram_series}
+
+metrics = Metrics()
+
+class EventBroker:
+    # Fans job and printer events out to /events streams. Every subscriber has
+    # a bounded queue; one that falls behind is dropped instead of slowing the
+    # printer threads, and catches up from the history when it reconnects.
+    # In a worker process, 'remote' reaches the supervisor: it keeps the
+    # history and only forwards events while the worker has a stream open.
+    def __init__(self, history=EVENT_HISTORY, queue_size=EVENT_QUEUE_SIZE, max_subscribers=EVENT_MAX_SUBSCRIBERS):
+        self.lock = threading.Lock()
+        self.listen_lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.history = deque(maxlen=history)
+        self.subscribers = set()
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.forward = None
+        self.remote = None
+
+    def publish(self, event, data, event_id=None):
+        # Workers republish the supervisor's events under its ids, so a
+        # Last-Event-ID is valid whichever worker the client reconnects to
+        with self.lock:
+            message = (event_id or next(self.ids), event, data, json.dumps(data))
+            self.history.append(message)
+            subscribers = list(self.subscribers)
+        if self.forward is not None:
+            self.forward(event, data, message[0])
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                subscriber.dropped = True
+
+    def subscribe(self, last_id=None):
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None, []
+            subscriber = queue.Queue(self.queue_size)
+            subscriber.dropped = False
+            self.subscribers.add(subscriber)
+        if self.remote is None:
+            return subscriber, self.since(last_id) if last_id is not None else []
+        self.listen()
+        return subscriber, self.remote('events', last_id) if last_id is not None else []
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+        if self.remote is not None:
+            self.listen()
+
+    def since(self, last_id):
+        with self.lock:
+            return [message for message in self.history if message[0] > last_id]
+
+    def listen(self):
+        # Serialized so the supervisor always ends up with the latest state.
+        # Not under self.lock, the pipe reader publishes while this waits.
+        with self.listen_lock:
+            with self.lock:
+                listening = bool(self.subscribers)
+            self.remote('listen', listening)
+
+events = EventBroker()
+
+class PooledConnection:
+    def __init__(self, pool, address, sock, reused, printer_ip, mode):
+        self.pool = pool
+        self.address = address
+        self.printer_ip = printer_ip
+        self.mode = mode
+        self.sock = sock
+        self.reused = reused
+
+    def sendall(self, data):
+        try:
+            self.sock.sendall(data)
+        except OSError:
+            if not self.reused:
+                raise
+            # The printer dropped the idle connection, reconnect once and resend
+            logging.info("Pooled connection to %s:%s went stale, reconnecting", *self.address)
+            self.sock.close()
+            self.sock = self.pool.connect(self.address, self.printer_ip, self.mode)
+            self.sock.sendall(data)
+        self.reused = False
+
+class PrinterConnectionPool:
+    # Keeps port-9100 sockets open between jobs, keyed on the parsed host:port
+    def __init__(self, connect_timeout=PRINTER_CONNECT_TIMEOUT, idle_timeout=PRINTER_IDLE_TIMEOUT,
+                 max_connections=PRINTER_MAX_CONNECTIONS):
+        self.connect_timeout = connect_timeout
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.slots = {}
+        self.active = {}
+        self.reaper = None
+
+    def connect(self, address, printer_ip, mode):
+        started = time.perf_counter()
+        sock = socket.create_connection(address, timeout=self.connect_timeout)
+        metrics.observe('printer_connect_seconds', time.perf_counter() - started, printer=printer_ip, mode=mode)
+        logging.info("Connection successful to %s:%s", *address)
+        return sock
+
+    def is_alive(self, sock):
+        # A readable idle socket means the printer closed it or reset it
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return True
+            sock.setblocking(False)
+            try:
+                return sock.recv(1024, socket.MSG_PEEK) != b''
+            finally:
+                sock.settimeout(self.connect_timeout)
+        except (OSError, ValueError):
+            return False
+
+    def checkout(self, address, printer_ip, mode):
+        with self.lock:
+            idle = self.idle.get(address, [])
+            while idle:
+                sock, _ = idle.pop()
+                if self.is_alive(sock):
+                    return sock, True
+                sock.close()
+        return self.connect(address, printer_ip, mode), False
+
+    def checkin(self, address, sock):
+        with self.lock:
+            self.idle.setdefault(address, []).append((sock, time.monotonic()))
+            if self.reaper is None:
+                self.reaper = threading.Thread(target=self.reap_idle, daemon=True)
+                self.reaper.start()
+
+    def reap_idle(self):
+        while True:
+            time.sleep(max(self.idle_timeout / 2, 1))
+            cutoff = time.monotonic() - self.idle_timeout
+            with self.lock:
+                for address, idle in self.idle.items():
+                    expired = [sock for sock, last_used in idle if last_used < cutoff]
+                    idle[:] = [(sock, last_used) for sock, last_used in idle if last_used >= cutoff]
+                    for sock in expired:
+                        logging.info("Closing idle connection to %s:%s", *address)
+                        sock.close()
+
+    @contextmanager
+    def connection(self, printer_ip, mode='IP'):
+        address = parse_printer_address(printer_ip)
+        with self.lock:
+            slot = self.slots.setdefault(address, threading.BoundedSemaphore(self.max_connections))
+        if not slot.acquire(timeout=self.connect_timeout):
+            raise socket.timeout(f"All {self.max_connections} connections to {address[0]}:{address[1]} are busy")
+        with self.lock:
+            self.active[address] = self.active.get(address, 0) + 1
+        try:
+            sock, reused = self.checkout(address, printer_ip, mode)
+            conn = PooledConnection(self, address, sock, reused, printer_ip, mode)
+            try:
+                yield conn
+            except BaseException:
+                conn.sock.close()
+                raise
+            self.checkin(address, conn.sock)
+        finally:
+            with self.lock:
+                self.active[address] -= 1
+            slot.release()
+
+    def has_connections(self, printer_ip):
+        # Printers often accept a single connection, so one we already hold
+        # is the only sign of life we can get without disturbing it
+        address = parse_printer_address(printer_ip)
+        with self.lock:
+            return bool(self.active.get(address) or self.idle.get(address))
+
+    def close_all(self):
+        with self.lock:
+            for idle in self.idle.values():
+                for sock, _ in idle:
+                    sock.close()
+            self.idle.clear()
+
+class CircuitBreaker:
+    # closed: jobs flow. open: the printer is down and jobs fail at once.
+    # half_open: the reset timeout passed and one trial job is let through.
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        if self.state == 'closed':
+            return True
+        if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = 'half_open'
+            return True
+        return False
+
+    def available(self):
+        # Like allow() but without claiming the half-open trial
+        return self.state != 'open' or time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def record_success(self):
+        changed = self.state != 'closed'
+        self.state = 'closed'
+        self.failures = 0
+        return changed
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+            self.state = 'open'
+            self.opened_at = time.monotonic()
             return True
+        if self.state == 'open':
+            self.opened_at = time.monotonic()
+        return False
+
+class PrinterHealth:
+    # Keeps a cached reachability state per printer from job outcomes and
+    # periodic TCP connect probes, and feeds each printer's circuit breaker
+    def __init__(self, interval=PROBE_INTERVAL, timeout=PROBE_TIMEOUT, expiry=PRINTER_HEALTH_EXPIRY):
+        self.interval = interval
+        self.timeout = timeout
+        self.expiry = expiry
+        self.condition = threading.Condition()
+        self.printers = {}
+        self.prober = None
+
+    def entry(self, printer_ip):
+        entry = self.printers.get(printer_ip)
+        if entry is None:
+            entry = self.printers[printer_ip] = {
+                'breaker': CircuitBreaker(),
+                'reachable': None,
+                'last_checked': None,
+                'last_success': None,
+                'last_used': time.monotonic()
+            }
+            if self.prober is None:
+                self.prober = threading.Thread(target=self.probe_loop, daemon=True, name='printer-prober')
+                self.prober.start()
+        return entry
+
+    def allow(self, printer_ip):
+        with self.condition:
+            entry = self.entry(printer_ip)
+            entry['last_used'] = time.monotonic()
+            return entry['breaker'].allow()
+
+    def record(self, printer_ip, success, source='job'):
+        with self.condition:
+            entry = self.entry(printer_ip)
+            entry['reachable'] = success
+            entry['last_checked'] = time.time()
+            if success:
+                entry['last_success'] = time.monotonic()
+                if entry['breaker'].record_success():
+                    logging.info("Printer %s is reachable again (%s), accepting jobs", printer_ip, source)
+                    self.condition.notify_all()
+                    events.publish('printer', {"printer": printer_ip, "state": 'closed', "reachable": True})
+            elif entry['breaker'].record_failure():
+                logging.warning("Printer %s is unreachable (%s), failing its jobs fast", printer_ip, source)
+                events.publish('printer', {"printer": printer_ip, "state": 'open', "reachable": False})
+
+    def available(self, printer_ip):
+        with self.condition:
+            entry = self.printers.get(printer_ip)
+            return entry is None or entry['breaker'].available()
+
+    def wait_until_available(self, printer_ip, timeout):
+        # Only waits, the send path still claims the half-open trial itself
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while not self.entry(printer_ip)['breaker'].available():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(min(remaining, self.interval))
+            return True
+
+    def probe(self, printer_ip):
+        try:
+            with socket.create_connection(parse_printer_address(printer_ip), timeout=self.timeout):
+                return True
+        except (OSError, ValueError):
+            return False
+
+    def probe_loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self.condition:
+                # Printers that have had no job for a while are dropped rather than probed forever
+                now = time.monotonic()
+                for printer_ip in [printer_ip for printer_ip, entry in self.printers.items()
+                                   if now - entry['last_used'] > self.expiry]:
+                    del self.printers[printer_ip]
+                printers = [(printer_ip, entry['last_success']) for printer_ip, entry in self.printers.items()]
+            for printer_ip, last_success in printers:
+                # A recent job or a connection we hold already proves the printer is up
+                if last_success and time.monotonic() - last_success < self.interval:
+                    continue
+                if connection_pool.has_connections(printer_ip):
+                    continue
+                self.record(printer_ip, self.probe(printer_ip), source='probe')
+
+    def status(self):
+        with self.condition:
+            return {printer_ip: {
+                "state": entry['breaker'].state,
+                "reachable": entry['reachable'],
+                "consecutive_failures": entry['breaker'].failures,
+                "last_checked": datetime.fromtimestamp(entry['last_checked']).isoformat() if entry['last_checked'] else None
+            } for printer_ip, entry in self.printers.items()}
+
+load_label_templates()
+label_templates = compile_label_templates()
+connection_pool = PrinterConnectionPool()
+printer_health = PrinterHealth()
+
+def send_to_network_printer(printer_ip, data, mode='IP'):
+    if printer_owner is not None:
+        return printer_owner.call('send', printer_ip, [data], mode)[0][0]
+    if not printer_health.allow(printer_ip):
+        metrics.inc('printer_jobs_total', printer=printer_ip, mode=mode, result='rejected')
+        logging.error("Printer at %s is offline, print job rejected", printer_ip)
+        return False
+    try:
+        with metrics.in_flight(printer=printer_ip, mode=mode), connection_pool.connection(printer_ip, mode) as s:
+            started = time.perf_counter()
+            s.sendall(data)
+            metrics.observe('printer_send_seconds', time.perf_counter() - started, printer=printer_ip, mode=mode)
+            metrics.inc('printer_bytes_sent_total', len(data), printer=printer_ip, mode=mode)
+            metrics.inc('printer_jobs_total', printer=printer_ip, mode=mode, result='succeeded')
+            log_payload(printer_ip, data)
+            
+            logging.info("Print job sent successfully to %s", printer_ip)
+        printer_health.record(printer_ip, True)
+        return True
             
     except socket.timeout:
-        logging.error(f"Connection timeout to printer at {printer_ip}")
-        return False
+        metrics.inc('printer_jobs_total', printer=printer_ip, mode=mode, result='timed_out')
+        logging.error("Connection timeout to printer at %s", printer_ip)
     except Exception as e:
-        logging.error(f"Failed to send data to printer at {printer_ip}: {str(e)}")
-        return False
+        metrics.inc('printer_jobs_total', printer=printer_ip, mode=mode, result='failed')
+        logging.error("Failed to send data to printer at %s: %s", printer_ip, e)
+    printer_health.record(printer_ip, False)
+    return False
+
+def send_batch_to_network_printer(printer_ip, payloads, mode='IP'):
+    # Streams every label over a single connection and returns one
+    # (success, error) tuple per payload, in order
+    if printer_owner is not None:
+        return printer_owner.call('send', printer_ip, payloads, mode)
+    results = []
+    if not printer_health.allow(printer_ip):
+        metrics.inc('printer_jobs_total', len(payloads), printer=printer_ip, mode=mode, result='rejected')
+        logging.error("Printer at %s is offline, batch of %d print jobs rejected", printer_ip, len(payloads))
+        return [(False, "Printer is offline")] * len(payloads)
+    try:
+        with metrics.in_flight(printer=printer_ip, mode=mode), connection_pool.connection(printer_ip, mode) as s:
+            for data in payloads:
+                started = time.perf_counter()
+                s.sendall(data)
+                metrics.observe('printer_send_seconds', time.perf_counter() - started, printer=printer_ip, mode=mode)
+                metrics.inc('printer_bytes_sent_total', len(data), printer=printer_ip, mode=mode)
+                metrics.inc('printer_jobs_total', printer=printer_ip, mode=mode, result='succeeded')
+                log_payload(printer_ip, data)
+                results.append((True, None))
+
+            logging.info("Batch of %d print jobs sent successfully to %s", len(results), printer_ip)
+        printer_health.record(printer_ip, True)
+
+    except socket.timeout:
+        logging.error("Connection timeout to printer at %s", printer_ip)
+        error, result = "Connection timeout", 'timed_out'
+    except Exception as e:
+        logging.error("Failed to send batch to printer at %s: %s", printer_ip, e)
+        error, result = str(e), 'failed'
+    else:
+        return results
+
+    printer_health.record(printer_ip, False)
+
+    # Everything after the failing label is unsent once the connection drops
+    unsent = len(payloads) - len(results)
+    metrics.inc('printer_jobs_total', unsent, printer=printer_ip, mode=mode, result=result)
+    results.extend((False, error) for _ in range(unsent))
+    return results
+
+def printer_target(mode, printer_connection):
+    return printer_connection if mode == 'IP' else printer_connection.replace('USB:', '')
+
+def send_to_printer(mode, printer_connection, data):
+    return send_to_network_printer(printer_target(mode, printer_connection), data, mode)
+
+class PrinterOwner:
+    # Runs in the supervisor when serving with --workers. Each printer gets one
+    # thread that sends labels in the order the workers handed them over and
+    # takes the job queue's lane for that printer, so a device only ever has
+    # one writer however many processes take requests.
+    # The workers' shared() calls for jobs, recent labels and imports are
+    # answered here too.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.connections = []
+        self.listening = set()
+
+    def serve(self, conn):
+        # Reads the requests of one worker process until it exits
+        send_lock = threading.Lock()
+        with self.lock:
+            self.connections.append((conn, send_lock))
+        while True:
+            try:
+                request_id, kind, args = conn.recv()
+            except (EOFError, OSError):
+                with self.lock:
+                    self.connections.remove((conn, send_lock))
+                    self.listening.discard(conn)
+                return
+            if kind == 'listen':
+                # Events only go to workers with an open /events stream
+                with self.lock:
+                    if args[0]:
+                        self.listening.add(conn)
+                    else:
+                        self.listening.discard(conn)
+                self.reply(conn, send_lock, request_id, None)
+            elif kind == 'send':
+                printer_ip, payloads, mode = args
+                self.queue(printer_ip).put((conn, send_lock, request_id, payloads, mode))
+            elif kind == 'wait':
+                # Blocks until the job finishes, so it must not hold up this reader
+                threading.Thread(target=self.call, args=(conn, send_lock, request_id, kind, args),
+                                 daemon=True, name='owner-wait').start()
+            else:
+                self.call(conn, send_lock, request_id, kind, args)
+
+    def call(self, conn, send_lock, request_id, kind, args):
+        try:
+            result = SHARED_CALLS[kind](*args)
+        except Exception as e:
+            result = e
+        self.reply(conn, send_lock, request_id, result)
+
+    def queue(self, printer_ip):
+        with self.lock:
+            jobs = self.queues.get(printer_ip)
+            if jobs is None:
+                jobs = self.queues[printer_ip] = queue.Queue()
+                threading.Thread(target=self.worker, args=(printer_ip, jobs), daemon=True,
+                                 name=f"owner-{printer_ip}").start()
+            return jobs
+
+    def worker(self, printer_ip, jobs):
+        while True:
+            conn, send_lock, request_id, payloads, mode = jobs.get()
+            # Shares the printer's lane with the job queue worker
+            with job_queue.lane(printer_ip):
+                if len(payloads) == 1:
+                    results = [(send_to_network_printer(printer_ip, payloads[0], mode), None)]
+                else:
+                    results = send_batch_to_network_printer(printer_ip, payloads, mode)
+            self.reply(conn, send_lock, request_id, results)
+
+    def broadcast(self, event, data, event_id):
+        # Job and printer events happen here, the workers pass them on to their /events streams
+        with self.lock:
+            connections = [(conn, send_lock) for conn, send_lock in self.connections if conn in self.listening]
+        for conn, send_lock in connections:
+            self.reply(conn, send_lock, None, (event, data, event_id))
+
+    @staticmethod
+    def reply(conn, send_lock, request_id, result):
+        try:
+            with send_lock:
+                conn.send((request_id, result))
+        except OSError:
+            # The worker died mid-request; the supervisor restarts it
+            pass
+
+class PrinterOwnerClient:
+    # Runs in a worker process and hands all printer I/O and shared state
+    # lookups to the supervisor
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.ids = itertools.count()
+        threading.Thread(target=self.read_loop, daemon=True, name='printer-owner').start()
+
+    def call(self, kind, *args):
+        slot = {'done': threading.Event()}
+        with self.lock:
+            request_id = next(self.ids)
+            self.pending[request_id] = slot
+            self.conn.send((request_id, kind, args))
+        slot['done'].wait()
+        if isinstance(slot['result'], Exception):
+            raise slot['result']
+        return slot['result']
+
+    def read_loop(self):
+        while True:
+            try:
+                request_id, result = self.conn.recv()
+            except (EOFError, OSError):
+                logging.error("Lost the connection to the supervisor, stopping worker")
+                os._exit(1)
+            if request_id is None:
+                events.publish(*result)
+                continue
+            with self.lock:
+                slot = self.pending.pop(request_id)
+            slot['result'] = result
+            slot['done'].set()
+
+printer_owner = None
+
+def shared(kind, *args):
+    # Jobs, recent labels, imports and printer health live in one process:
+    # the supervisor when serving with --workers, otherwise this one
+    if printer_owner is not None:
+        return printer_owner.call(kind, *args)
+    return SHARED_CALLS[kind](*args)
+
+def instrument(route):
+    # Records latency and response codes of a Flask view in /metrics
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            code = 500
+            try:
+                response = view(*args, **kwargs)
+                code = response[1] if isinstance(response, tuple) else getattr(response, 'status_code', 200)
+                return response
+            finally:
+                metrics.observe('http_request_seconds', time.perf_counter() - started, route=route)
+                metrics.inc('http_requests_total', route=route, code=code)
+        return wrapper
+    return decorator
+
+class PrintSpool:
+    # Append-only log of accepted jobs: the rendered label bytes of every job
+    # followed by its state transitions. Payloads are read back through a
+    # memory map, so queued jobs don't hold their labels in memory while a
+    # printer is offline. Failed jobs stay in the log so they can be retried.
+    HEADER = struct.Struct('<IBI')  # crc32 of the payload, record type, payload length
+    JOB = 1
+    STATE = 2
+
+    def __init__(self, path=SPOOL_FILE, fsync=SPOOL_FSYNC):
+        self.path = path
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.file = None
+        self.map = None
+        self.size = 0
+
+    def open(self):
+        self.file = open(self.path, 'a+b')
+        self.size = self.file.seek(0, os.SEEK_END)
+        self.map = None
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def mapped(self):
+        # Remap once the file has grown past the current mapping
+        if self.map is None or len(self.map) < self.size:
+            if self.map is not None:
+                self.map.close()
+            self.file.flush()
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map
+
+    def write_record(self, kind, payload):
+        offset = self.size
+        self.file.write(self.HEADER.pack(zlib.crc32(payload), kind, len(payload)) + payload)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.size += self.HEADER.size + len(payload)
+        return offset
+
+    def job_record(self, job_id, meta, data):
+        meta = json.dumps({**meta, "id": job_id}).encode('utf-8')
+        payload = struct.pack('<H', len(meta)) + meta + data
+        offset = self.write_record(self.JOB, payload)
+        self.entries[job_id] = {
+            'meta': json.loads(meta),
+            'offset': offset + self.HEADER.size + 2 + len(meta),
+            'length': len(data),
+            'record_size': self.HEADER.size + len(payload),
+            'state': 'queued'
+        }
+
+    def append(self, job):
+        meta = {"mode": job.mode, "printer": job.printer, "group": job.group, "SN": job.serial_number,
+                "queued_at": job.queued_at}
+        with self.lock:
+            self.job_record(job.id, meta, job.data)
+
+    def mark(self, job_id, state, error=None):
+        with self.lock:
+            entry = self.entries.get(job_id)
+            if entry is None:
+                return
+            self.write_record(self.STATE, json.dumps({"id": job_id, "state": state, "error": error}).encode('utf-8'))
+            if state == 'done':
+                del self.entries[job_id]
+            else:
+                entry['state'] = state
+                entry['error'] = error
+
+    def failed(self, job_id):
+        with self.lock:
+            entry = self.entries.get(job_id)
+            if entry is None or entry['state'] != 'failed':
+                return None
+            return dict(entry['meta']), entry.get('error')
+
+    def read(self, job_id):
+        with self.lock:
+            entry = self.entries[job_id]
+            return bytes(self.mapped()[entry['offset']:entry['offset'] + entry['length']])
+
+    def load(self):
+        # Rebuilds the unfinished jobs from the log. A torn record at the end
+        # (crash mid-write) is cut off.
+        with self.lock:
+            self.open()
+            self.entries.clear()
+            if not self.size:
+                return []
+            view = self.mapped()
+            position = 0
+            while position + self.HEADER.size <= self.size:
+                crc, kind, length = self.HEADER.unpack_from(view, position)
+                start = position + self.HEADER.size
+                payload = view[start:start + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                if kind == self.JOB:
+                    meta_length, = struct.unpack_from('<H', payload)
+                    meta = json.loads(payload[2:2 + meta_length])
+                    self.entries[meta['id']] = {
+                        'meta': meta,
+                        'offset': start + 2 + meta_length,
+                        'length': length - 2 - meta_length,
+                        'record_size': self.HEADER.size + length,
+                        'state': 'queued'
+                    }
+                elif kind == self.STATE:
+                    record = json.loads(payload)
+                    if record['state'] == 'done':
+                        self.entries.pop(record['id'], None)
+                    elif record['id'] in self.entries:
+                        self.entries[record['id']]['state'] = record['state']
+                        self.entries[record['id']]['error'] = record.get('error')
+                position = start + length
+
+            if position < self.size:
+                logging.warning("Discarding %d bytes of incomplete spool records", self.size - position)
+                self.map.close()
+                self.map = None
+                self.file.truncate(position)
+                self.size = position
+            return [(job_id, dict(entry['meta']), entry['state'], entry.get('error'))
+                    for job_id, entry in self.entries.items()]
+
+    def compact(self):
+        # Rewrites the log with only the unfinished and retryable jobs once
+        # enough of it is dead. Payloads are copied one job at a time from
+        # the old file's mapping.
+        with self.lock:
+            expired = time.time() - SPOOL_FAILED_RETENTION
+            for job_id in [job_id for job_id, entry in self.entries.items()
+                           if entry['state'] == 'failed' and entry['meta'].get('queued_at', 0) < expired]:
+                del self.entries[job_id]
+            live_bytes = sum(entry['record_size'] for entry in self.entries.values())
+            if self.size - live_bytes < SPOOL_COMPACT_MIN_BYTES:
+                return
+            view = self.mapped()
+            source = self.file
+            live = list(self.entries.items())
+            reclaimed = self.size - live_bytes
+            temp_path = self.path + '.tmp'
+            self.file = open(temp_path, 'w+b')
+            self.map = None
+            self.size = 0
+            self.entries.clear()
+            for job_id, entry in live:
+                meta = {key: value for key, value in entry['meta'].items() if key != 'id'}
+                self.job_record(job_id, meta, view[entry['offset']:entry['offset'] + entry['length']])
+                if entry['state'] == 'failed':
+                    self.write_record(self.STATE, json.dumps(
+                        {"id": job_id, "state": 'failed', "error": entry.get('error')}).encode('utf-8'))
+                    self.entries[job_id].update(state='failed', error=entry.get('error'))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            view.close()
+            source.close()
+            os.replace(temp_path, self.path)
+            self.open()
+        logging.info("Compacted print spool: %d jobs kept, %d bytes reclaimed", len(live), reclaimed)
+
+    def compact_loop(self):
+        while True:
+            time.sleep(SPOOL_COMPACT_INTERVAL)
+            try:
+                self.compact()
+            except Exception as e:
+                logging.error(f"Failed to compact print spool: {str(e)}")
+
+class TTLCache:
+    # Bounded LRU of recent entries that also expire after ttl seconds
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def find(self, predicate):
+        with self.lock:
+            now = time.monotonic()
+            for expires, value in reversed(self.entries.values()):
+                if expires >= now and predicate(value):
+                    return value
+        return None
+
+def idempotency_key(mode, printer_connection, data):
+    # Hashes the rendered label, so a request with corrected fields prints again
+    return hashlib.sha1(f"{mode}|{printer_connection}|".encode('utf-8') + data).hexdigest()
+
+class PrintJob:
+    def __init__(self, mode, printer, data, serial_number=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.mode = mode
+        self.printer = printer
+        # Jobs sent to a printer group remember it so they can fail over
+        self.group = printer_groups.group_name(printer)
+        self.tried = set()
+        self.data = data
+        self.serial_number = serial_number
+        self.state = 'queued'
+        self.error = None
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def transition(self, state):
+        self.state = state
+        if print_spool is not None:
+            print_spool.mark(self.id, state)
+        events.publish('job', self.to_dict())
+
+    def payload(self):
+        return self.data if self.data is not None else print_spool.read(self.id)
+
+    def finish(self, success, error=None):
+        self.finished_at = time.time()
+        self.state = 'done' if success else 'failed'
+        self.error = None if success else (error or f"Failed to send print job to {self.mode} printer")
+        if print_spool is not None:
+            print_spool.mark(self.id, self.state, self.error)
+        self.done.set()
+        events.publish('job', self.to_dict())
+
+    def to_dict(self):
+        def elapsed_ms(start, end):
+            return round((end - start) * 1000, 1) if start and end else None
+
+        def iso(timestamp):
+            return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
+
+        return {
+            "job_id": self.id,
+            "state": self.state,
+            "mode": self.mode,
+            "printer": self.printer,
+            "group": self.group,
+            "SN": self.serial_number,
+            "error": self.error,
+            "queued_at": iso(self.queued_at),
+            "started_at": iso(self.started_at),
+            "finished_at": iso(self.finished_at),
+            "wait_ms": elapsed_ms(self.queued_at, self.started_at),
+            "send_ms": elapsed_ms(self.started_at, self.finished_at),
+            "total_ms": elapsed_ms(self.queued_at, self.finished_at)
+        }
+
+class PrintJobQueue:
+    # One worker thread per printer, so each device receives its jobs in order
+    # and a slow printer never blocks the HTTP threads
+    def __init__(self, history=JOB_HISTORY):
+        self.history = history
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.lanes = {}
+        self.jobs = OrderedDict()
+
+    def submit(self, job, spooled=False):
+        if job.group and printer_groups.is_group(job.printer):
+            member = printer_groups.select(job.group, job.mode)
+            if member is None:
+                raise ValueError(f"Printer group {job.group} has no members")
+            job.printer = member
+        self.accept(job, spooled)
+        self.enqueue([job])
+        return job
+
+    def submit_batch(self, batch):
+        # Labels posted together for one printer are queued as one item, so
+        # the worker sends them back to back over a single connection
+        for job in batch:
+            self.accept(job)
+        self.enqueue(batch)
+        return batch
+
+    def accept(self, job, spooled=False):
+        if print_spool is not None and not spooled:
+            print_spool.append(job)
+            job.data = None
+        with self.lock:
+            self.jobs[job.id] = job
+            self.prune()
+        events.publish('job', job.to_dict())
+
+    def enqueue(self, batch):
+        key = (batch[0].mode, batch[0].printer)
+        with self.lock:
+            jobs = self.queues.get(key)
+            if jobs is None:
+                jobs = self.queues[key] = queue.Queue()
+                threading.Thread(target=self.worker, args=(jobs,), daemon=True,
+                                 name=f"printer-{key[0]}-{key[1]}").start()
+        jobs.put(batch)
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def find(self, job_id):
+        # Failed jobs stay in the spool after they drop out of the history
+        job = self.get(job_id)
+        if job is None and print_spool is not None:
+            spooled = print_spool.failed(job_id)
+            if spooled is not None:
+                job = spooled_job(job_id, spooled[0])
+                job.state, job.error = 'failed', spooled[1]
+                job.done.set()
+        return job
+
+    def restore(self, job):
+        with self.lock:
+            self.jobs[job.id] = job
+            self.prune()
+
+    def retry(self, job):
+        # Sends a failed job again under the same id; a group job may pick a
+        # different member this time
+        job.state = 'queued'
+        job.error = None
+        job.started_at = job.finished_at = None
+        job.tried = set()
+        job.done.clear()
+        if job.group:
+            job.printer = GROUP_PREFIX + job.group
+        if print_spool is not None:
+            print_spool.mark(job.id, 'queued')
+        return self.submit(job, spooled=print_spool is not None)
+
+    def depths(self):
+        with self.lock:
+            return {key: jobs.qsize() for key, jobs in self.queues.items()}
+
+    def lane(self, target):
+        # Held for every send to a printer, so labels sent outside the queue
+        # wait for the queued job in flight instead of opening a second socket
+        with self.lock:
+            return self.lanes.setdefault(target, threading.Lock())
+
+    def prune(self):
+        # Forget the oldest finished jobs once the history is full
+        while len(self.jobs) > self.history:
+            job_id, job = next(iter(self.jobs.items()))
+            if not job.done.is_set():
+                break
+            del self.jobs[job_id]
+
+    def collect(self, jobs, first):
+        # Gathers the jobs that arrive for the same printer within the
+        # coalescing window so they go out over one connection
+        batch = list(first)
+        deadline = time.monotonic() + COALESCE_WINDOW
+        while len(batch) < COALESCE_MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.extend(jobs.get(timeout=remaining) if remaining > 0 else jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def worker(self, jobs):
+        while True:
+            batch = jobs.get()
+            job = batch[0]
+            target = printer_target(job.mode, job.printer)
+            if OFFLINE_PARK_TIMEOUT and not printer_health.available(target):
+                # Hold the jobs until the prober sees the printer again
+                for item in batch:
+                    item.transition('parked')
+                printer_health.wait_until_available(target, OFFLINE_PARK_TIMEOUT)
+
+            if COALESCE_WINDOW > 0:
+                batch = self.collect(jobs, batch)
+            with self.lane(target):
+                try:
+                    for item in batch:
+                        # Set first so the 'sending' event already carries wait_ms
+                        item.started_at = time.time()
+                        item.transition('sending')
+                    if len(batch) == 1:
+                        self.complete(job, send_to_printer(job.mode, job.printer, job.payload()))
+                        continue
+                    logging.info("Sending %d print jobs to %s over one connection", len(batch), target)
+                    outcomes = send_batch_to_network_printer(target, [item.payload() for item in batch], job.mode)
+                    for item, (success, error) in zip(batch, outcomes):
+                        self.complete(item, success, error)
+                except Exception as e:
+                    logging.error("Print job %s failed: %s", job.id, e)
+                    for item in batch:
+                        if not item.done.is_set():
+                            item.finish(False, str(e))
+
+    def complete(self, job, success, error=None):
+        if success:
+            printer_groups.observe(job.printer, time.time() - job.started_at)
+        elif job.group:
+            # Fail over to another healthy member of the group
+            job.tried.add(job.printer)
+            member = printer_groups.select(job.group, job.mode, exclude=job.tried)
+            if member is not None:
+                logging.warning("Print job %s failed on %s, failing over to %s", job.id, job.printer, member)
+                job.printer = member
+                job.transition('queued')
+                self.enqueue([job])
+                return
+        job.finish(success, error)
+
+class PrinterGroups:
+    # Named sets of interchangeable printers. Clients send PRINTER=group:<name>
+    # and each job goes to the member with the shortest queue, then the lowest
+    # recent send latency.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.groups = {}
+        self.latency = {}
+
+    def load(self, path=PRINTER_GROUPS_FILE):
+        # {"ql-62mm": {"mode": "IP", "printers": ["10.0.0.21", "10.0.0.22:9100"]}}
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                groups = json.load(f)
+            with self.lock:
+                self.groups = {name: list(group['printers']) for name, group in groups.items()}
+            logging.info(f"Loaded {len(groups)} printer groups from {path}")
+        except Exception as e:
+            logging.error(f"Failed to load printer groups from {path}: {str(e)}")
+
+    @staticmethod
+    def is_group(printer_connection):
+        return printer_connection.startswith(GROUP_PREFIX)
+
+    def group_name(self, printer_connection):
+        return printer_connection[len(GROUP_PREFIX):] if self.is_group(printer_connection) else None
+
+    def members(self, name):
+        with self.lock:
+            return list(self.groups.get(name, []))
+
+    def resolve(self, printer_connection, mode):
+        # Picks a member for routes that send directly instead of through the queue
+        name = self.group_name(printer_connection)
+        return self.select(name, mode) if name else printer_connection
+
+    def select(self, name, mode, exclude=()):
+        candidates = [member for member in self.members(name) if member not in exclude]
+        healthy = [member for member in candidates if printer_health.available(printer_target(mode, member))]
+        if not healthy:
+            return None if exclude else (candidates[0] if candidates else None)
+        depths = job_queue.depths()
+        with self.lock:
+            return min(healthy, key=lambda member: (depths.get((mode, member), 0), self.latency.get(member, 0)))
+
+    def observe(self, printer, seconds):
+        with self.lock:
+            previous = self.latency.get(printer)
+            self.latency[printer] = seconds if previous is None else (
+                LATENCY_EWMA_ALPHA * seconds + (1 - LATENCY_EWMA_ALPHA) * previous)
+
+    def status(self):
+        depths = job_queue.depths()
+        with self.lock:
+            return {name: [{
+                "printer": member,
+                "queue_depth": sum(depth for (_, printer), depth in depths.items() if printer == member),
+                "latency_ms": round(self.latency[member] * 1000, 1) if member in self.latency else None
+            } for member in members] for name, members in self.groups.items()}
+
+printer_groups = PrinterGroups()
+printer_groups.load()
+job_queue = PrintJobQueue()
+recent_labels = TTLCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
+reprint_labels = TTLCache(REPRINT_CACHE_SIZE, REPRINT_TTL)
+print_spool = None
+
+def spooled_job(job_id, meta):
+    job = PrintJob(meta['mode'], meta['printer'], None, meta.get('SN'), job_id=job_id)
+    job.group = meta.get('group')
+    job.queued_at = meta.get('queued_at', job.queued_at)
+    return job
+
+def open_spool(path=SPOOL_FILE):
+    # Replays jobs that were accepted but not finished before the last exit.
+    # Failed jobs go back into the history, waiting for /jobs/<id>/retry.
+    global print_spool
+    spool = PrintSpool(path)
+    try:
+        pending = spool.load()
+    except OSError as e:
+        # e.g. the exe is installed in a read-only directory
+        spool.close()
+        logging.error("Cannot open print spool %s, keeping queued jobs in memory only: %s", path, e)
+        return None
+    print_spool = spool
+    replayed = 0
+    for job_id, meta, state, error in pending:
+        job = spooled_job(job_id, meta)
+        if state == 'failed':
+            job.state, job.error = 'failed', error
+            job.done.set()
+            job_queue.restore(job)
+            continue
+        job_queue.submit(job, spooled=True)
+        replayed += 1
+    if replayed:
+        logging.info("Replaying %d unfinished print jobs from %s", replayed, path)
+    threading.Thread(target=spool.compact_loop, daemon=True, name='spool-compactor').start()
+    return spool
+
+def submit_label(key, mode, printer_connection, serial_number, data):
+    # Retries of the same label inside the window get the original job back
+    # instead of a second print. The first request for a key leaves a
+    # placeholder while it queues the job, so only requests for that same
+    # key wait on it.
+    while True:
+        with recent_labels.lock:
+            cached = recent_labels.get(key)
+            job = job_queue.get(cached['job_id']) if cached and cached['job_id'] else None
+            if cached is None or (cached['job_id'] and (job is None or job.state == 'failed')):
+                placeholder = {"job_id": None, "ready": threading.Event()}
+                recent_labels.set(key, placeholder)
+                break
+        if job is not None:
+            return job, True
+        cached['ready'].wait(LABEL_WAIT_TIMEOUT)
+
+    try:
+        job = job_queue.submit(PrintJob(mode, printer_connection, data, serial_number))
+        placeholder['job_id'] = job.id
+        reprint_labels.set(job.id, {"job_id": job.id, "key": key, "mode": mode, "printer": printer_connection,
+                                    "SN": serial_number, "data": data})
+        return job, False
+    except Exception:
+        recent_labels.discard(key)
+        raise
+    finally:
+        placeholder['ready'].set()
+
+def queue_label(key, mode, printer_connection, serial_number, data):
+    job, duplicate = submit_label(key, mode, printer_connection, serial_number, data)
+    return job.to_dict(), duplicate
+
+def queue_batch(mode, printer_connection, labels):
+    batch = [PrintJob(mode, printer_connection, data, serial_number) for serial_number, data in labels]
+    return [job.to_dict() for job in job_queue.submit_batch(batch)]
+
+def reprint_label(key, job_id):
+    # Resends the cached bytes of a recent label, looked up by key or job id
+    cached = reprint_labels.find(lambda entry: entry['key'] == key) if key else reprint_labels.get(job_id)
+    if cached is None:
+        return None
+    logging.info("Reprinting SN=%s (job %s)", cached['SN'], cached['job_id'])
+    return job_queue.submit(PrintJob(cached['mode'], cached['printer'], cached['data'], cached['SN'])).to_dict()
+
+def job_state(job_id):
+    job = job_queue.find(job_id)
+    return job.to_dict() if job is not None else None
+
+def wait_for_job(job_id, timeout):
+    job = job_queue.find(job_id)
+    if job is None:
+        return None
+    job.done.wait(timeout)
+    return job.to_dict()
+
+def wait_for_jobs(job_ids, timeout):
+    # One deadline for the whole list, not one per job
+    deadline = time.monotonic() + timeout
+    return [wait_for_job(job_id, max(deadline - time.monotonic(), 0)) for job_id in job_ids]
+
+def retry_failed_job(job_id):
+    # Returns the job and whether it was queued again
+    job = job_queue.find(job_id)
+    if job is None or job.state != 'failed':
+        return (job.to_dict() if job is not None else None), False
+    logging.info("Retrying print job %s for SN=%s", job.id, job.serial_number)
+    job_queue.retry(job)
+    return job.to_dict(), True
+
+label_imports = OrderedDict()
+label_imports_lock = threading.Lock()
+
+def record_import(state):
+    with label_imports_lock:
+        label_imports[state['import_id']] = state
+        while len(label_imports) > JOB_HISTORY:
+            label_imports.popitem(last=False)
+
+def import_state(import_id):
+    with label_imports_lock:
+        return label_imports.get(import_id)
+
+def printer_metrics():
+    queue_depths = {('printer_queue_depth', (('mode', mode), ('printer', printer))): depth
+                    for (mode, printer), depth in job_queue.depths().items()}
+    return metrics.snapshot(queue_depths)
+
+SHARED_CALLS = {
+    'health': printer_health.status,
+    'groups': printer_groups.status,
+    'resolve': printer_groups.resolve,
+    'metrics': printer_metrics,
+    'submit': queue_label,
+    'submit_batch': queue_batch,
+    'reprint': reprint_label,
+    'job': job_state,
+    'wait': wait_for_job,
+    'wait_all': wait_for_jobs,
+    'retry': retry_failed_job,
+    'import': record_import,
+    'import_state': import_state,
+    'events': events.since
+}
+
+def resolve_printer(printer_connection, mode):
+    return shared('resolve', printer_connection, mode) if printer_groups.is_group(printer_connection) else printer_connection
+
+def send_in_lane(printer_ip, payloads, mode):
+    # Sends that bypass the job queue still wait for the printer's lane, so
+    # they never interleave with queued jobs. With --workers the supervisor
+    # takes the lane when it sends them.
+    if printer_owner is not None:
+        return printer_owner.call('send', printer_ip, payloads, mode)
+    with job_queue.lane(printer_ip):
+        return send_batch_to_network_printer(printer_ip, payloads, mode)
 
 @app.route('/', methods=['GET'])
 def health_check():
-    return jsonify({"status": "running", "timestamp": datetime.now().isoformat()})
+    return jsonify({
+        "status": "running",
+        "timestamp": datetime.now().isoformat(),
+        "printers": shared('health'),
+        "groups": shared('groups'),
+        "pid": os.getpid(),
+        "startup": {
+            "import_ms": round(import_seconds * 1000, 1),
+            "ready_ms": round(startup_seconds * 1000, 1) if startup_seconds is not None else None
+        }
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    try:
+        snapshot = shared('metrics')
+        if printer_owner is not None:
+            # The supervisor records the printer series, this worker its own requests
+            snapshot = Metrics.merge(snapshot, metrics.snapshot())
+        if request.args.get('format') == 'json':
+            return jsonify(metrics.to_dict(snapshot))
+        return Response(metrics.prometheus(snapshot), mimetype='text/plain; version=0.0.4')
+    except Exception as e:
+        logging.error(f"Error collecting metrics: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/scan', methods=['GET'])
 def scan_barcode():
@@ -92,7 +1683,7 @@ def scan_barcode():
         if not barcode_data:
             return jsonify({"status": "error", "message": "No barcode data provided"}), 400
             
-        logging.info(f"Received scan request: FORMAT={format_type}, DATA={barcode_data}")
+        logging.info("Received scan request: FORMAT=%s, DATA=%s", format_type, barcode_data)
         
         return jsonify({
             "status": "success",
@@ -105,6 +1696,7 @@ def scan_barcode():
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/label', methods=['GET'])
+@instrument('/label')
 def label():
     try:
         printer_connection = request.args.get('PRINTER', '')
@@ -116,51 +1708,369 @@ def label():
         username = request.args.get('USER', 'Unknown')
         date = datetime.now().strftime('%Y-%m-%d')
         
-        # Determine format type based on connection and printer model
-        if mode == 'IP':
-            format_type = '5'  # 62mm for QL network printers
-        else:
-            # USB mode - check printer model
-            if any(model in printer_connection for model in ['PT-700', 'PT-750','PT-900', 'PT-950']):
-                format_type = '2'  # 24mm for PT-7xx or PT-9xx series
-            elif any(model in printer_connection for model in ['PT-900', 'PT-950']):
-                format_type = '1'  # 36mm for PT-9xx series
-            else:
-                format_type = '5'  # Default to 62mm for QL series
+        format_type = resolve_format_type(mode, printer_connection)
         
-        logging.info(f"Received print request: PRINTER={printer_connection}, SN={serial_number}, MODEL={model}, Model_APN={model_apn}, TYPE={type_name}, MODE={mode}, FORMAT={format_type}")
+        logging.info("Received print request: PRINTER=%s, SN=%s, MODE=%s, FORMAT=%s",
+                     printer_connection, serial_number, mode, format_type)
+        logging.debug("Print request fields: MODEL=%s, Model_APN=%s, TYPE=%s, USER=%s",
+                      model, model_apn, type_name, username)
         
         if not serial_number:
             return jsonify({"status": "error", "message": "No serial number provided"}), 400
             
         data = create_label_data(format_type, serial_number, model, model_apn, type_name, username, date)
-        
-        if mode == 'IP':
-            success = send_to_network_printer(printer_connection, data)
-        else:
-            printer_name = printer_connection.replace('USB:', '')
-            success = sendend_to_network_printer(printer_name, data)
-            
-        if success:
-            return jsonify({"status": "success"})
-        return jsonify({"status": "error", "message": f"Failed to send print job to {mode} printer"}), 500
+        key = (request.args.get('IDEMPOTENCY_KEY') or request.headers.get('Idempotency-Key')
+               or idempotency_key(mode, printer_connection, data))
+        job, duplicate = shared('submit', key, mode, printer_connection, serial_number, data)
+        if duplicate:
+            logging.info("Duplicate print request for SN=%s, returning job %s", serial_number, job['job_id'])
+
+        return job_response(job, request.args.get('WAIT', ''), duplicate)
             
     except Exception as e:
         logging.error(f"Error processing print job: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+def job_response(job, wait, duplicate=False):
+    job_id = job['job_id']
+    extra = {"duplicate": True} if duplicate else {}
+    # WAIT=1 keeps the old blocking behaviour for clients that need the outcome
+    if wait.lower() not in ('1', 'true', 'yes'):
+        return jsonify({"status": "queued", "job_id": job_id, **extra}), 202
+
+    job = shared('wait', job_id, LABEL_WAIT_TIMEOUT) or job
+    if job['state'] == 'done':
+        return jsonify({"status": "success", "job_id": job_id, **extra})
+    if job['state'] == 'failed':
+        return jsonify({"status": "error", "job_id": job_id, "message": job['error'], **extra}), 500
+    return jsonify({"status": "queued", "job_id": job_id, "message": "Print job still pending", **extra}), 202
+
+@app.route('/reprint', methods=['GET', 'POST'])
+@instrument('/reprint')
+def reprint():
+    # Resends the cached bytes of a recent label, looked up by KEY or JOB id
+    try:
+        job = shared('reprint', request.args.get('KEY'), request.args.get('JOB'))
+        if job is None:
+            return jsonify({"status": "error", "message": "Label is not in the reprint cache"}), 404
+        return job_response(job, request.args.get('WAIT', ''))
+
+    except Exception as e:
+        logging.error(f"Error reprinting label: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = shared('job', job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Unknown job {job_id}"}), 404
+    return jsonify({"status": "success", "job": job})
+
+@app.route('/jobs/<job_id>/retry', methods=['POST'])
+@instrument('/jobs/retry')
+def retry_job(job_id):
+    # Requeues a failed job, e.g. once its printer is back online
+    try:
+        job, retried = shared('retry', job_id)
+        if job is None:
+            return jsonify({"status": "error", "message": f"Unknown job {job_id}"}), 404
+        if not retried:
+            return jsonify({"status": "error", "message": f"Job {job_id} is {job['state']}, only failed jobs can be retried"}), 409
+        return job_response(job, request.args.get('WAIT', ''))
+
+    except Exception as e:
+        logging.error(f"Error retrying print job: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/events', methods=['GET'])
+def event_stream():
+    # Server-Sent Events with job lifecycle (queued, parked, sending, done,
+    # failed) and printer up/down changes. JOB=<id> follows one job and ends
+    # once it finishes, PRINTER=<ip> narrows the stream to one printer.
+    job_id = request.args.get('JOB')
+    printer = request.args.get('PRINTER')
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('LAST_EVENT_ID')
+    try:
+        subscriber, backlog = events.subscribe(int(last_id) if last_id else None)
+    except ValueError:
+        return jsonify({"status": "error", "message": f"Invalid Last-Event-ID {last_id}"}), 400
+    if subscriber is None:
+        return jsonify({"status": "error", "message": "Too many open event streams"}), 503
+
+    job = None
+    if job_id and not any(event == 'job' and data['job_id'] == job_id for _, event, data, _ in backlog):
+        # The job may have finished before the client subscribed, or never existed
+        job = shared('job', job_id)
+        if job is None:
+            events.unsubscribe(subscriber)
+            return jsonify({"status": "error", "message": f"Unknown job {job_id}"}), 404
+
+    def wanted(event, data):
+        if job_id and (event != 'job' or data['job_id'] != job_id):
+            return False
+        return not printer or data['printer'] == printer
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            if job is not None and job['state'] in ('done', 'failed'):
+                yield f"event: job\ndata: {json.dumps(job)}\n\n"
+                return
+            messages = iter(backlog)
+            last_sent = 0
+            while not subscriber.dropped:
+                message = next(messages, None)
+                if message is None:
+                    try:
+                        message = subscriber.get(timeout=EVENT_KEEPALIVE)
+                    except queue.Empty:
+                        yield ": keepalive\n\n"
+                        continue
+                event_id, event, data, text = message
+                # Live events can repeat the tail of the backlog
+                if event_id <= last_sent or not wanted(event, data):
+                    continue
+                last_sent = event_id
+                yield f"id: {event_id}\nevent: {event}\ndata: {text}\n\n"
+                if job_id and data['state'] in ('done', 'failed'):
+                    return
+        finally:
+            events.unsubscribe(subscriber)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def parse_label_records(body, content_type):
+    # Accepts a JSON list, a JSON object with shared defaults plus a "labels"
+    # list, or NDJSON with one label record per line
+    text = body.decode('utf-8')
+    if 'ndjson' in content_type or 'jsonlines' in content_type:
+        return [json.loads(line) for line in text.splitlines() if line.strip()], {}
+
+    payload = json.loads(text)
+    if isinstance(payload, list):
+        return payload, {}
+    defaults = {key: value for key, value in payload.items() if key != 'labels'}
+    records = payload.get('labels', [])
+    if not isinstance(records, list):
+        raise ValueError('"labels" must be a list')
+    return records, defaults
+
+@app.route('/labels', methods=['POST'])
+@instrument('/labels')
+def bulk_labels():
+    try:
+        try:
+            records, defaults = parse_label_records(request.get_data(), request.content_type or '')
+        except (ValueError, AttributeError) as e:
+            return jsonify({"status": "error", "message": f"Invalid label records: {str(e)}"}), 400
+
+        if not records:
+            return jsonify({"status": "error", "message": "No label records provided"}), 400
+
+        date = datetime.now().strftime('%Y-%m-%d')
+        results = [None] * len(records)
+        batches = {}
+
+        for index, record in enumerate(records):
+            if not isinstance(record, dict):
+                results[index] = {"index": index, "SN": None, "printer": None,
+                                  "status": "error", "message": "Label record must be a JSON object"}
+                continue
+            item = {**defaults, **record}
+            serial_number = item.get('SN')
+            mode = item.get('MODE', 'IP')
+            printer_connection = resolve_printer(item.get('PRINTER', ''), mode)
+            results[index] = {"index": index, "SN": serial_number, "printer": printer_connection}
+
+            if not serial_number:
+                results[index].update({"status": "error", "message": "No serial number provided"})
+                continue
+            if printer_connection is None:
+                results[index].update({"status": "error", "message": "Printer group has no members"})
+                continue
+
+            format_type = resolve_format_type(mode, printer_connection)
+            data = create_label_data(format_type, serial_number, item.get('MODEL', ''),
+                                     item.get('Model_APN', ''), item.get('TYPE', ''),
+                                     item.get('USER', 'Unknown'), date)
+            batches.setdefault((mode, printer_connection), []).append((index, serial_number, data))
+
+        logging.info("Received bulk print request: %d labels for %d printers", len(records), len(batches))
+
+        # Each printer's labels are queued as one batch behind its other jobs
+        queued = []
+        for (mode, printer_connection), items in batches.items():
+            jobs = shared('submit_batch', mode, printer_connection,
+                          [(serial_number, data) for _, serial_number, data in items])
+            for (index, _, _), job in zip(items, jobs):
+                results[index]["job_id"] = job['job_id']
+                queued.append(index)
+
+        outcomes = shared('wait_all', [results[index]["job_id"] for index in queued], LABEL_WAIT_TIMEOUT)
+        for index, job in zip(queued, outcomes):
+            if job is None or job['state'] not in ('done', 'failed'):
+                results[index].update({"status": "queued", "message": "Print job still pending"})
+            elif job['state'] == 'done':
+                results[index]["status"] = "success"
+            else:
+                results[index].update({"status": "error", "message": job['error']})
+
+        printed = sum(1 for result in results if result["status"] == "success")
+        pending = sum(1 for result in results if result["status"] == "queued")
+        failed = len(results) - printed - pending
+        response = {
+            "status": "error" if failed else ("queued" if pending else "success"),
+            "printed": printed,
+            "queued": pending,
+            "failed": failed,
+            "results": results
+        }
+        return jsonify(response), (500 if failed else (202 if pending else 200))
+
+    except Exception as e:
+        logging.error(f"Error processing bulk print job: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+class LabelImport:
+    def __init__(self, import_id, printer, mode, start_row):
+        self.id = import_id
+        self.printer = printer
+        self.mode = mode
+        self.start_row = start_row
+        self.state = 'running'
+        self.rows_read = 0
+        self.printed = 0
+        self.skipped = 0
+        self.next_row = start_row
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self):
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "import_id": self.id,
+            "state": self.state,
+            "printer": self.printer,
+            "mode": self.mode,
+            "start_row": self.start_row,
+            "rows_read": self.rows_read,
+            "printed": self.printed,
+            "skipped": self.skipped,
+            "resume_from": self.next_row,
+            "error": self.error,
+            "labels_per_s": round(self.printed / elapsed, 1) if elapsed > 0 else None
+        }
+
+def read_import_rows(stream, content_type):
+    # Yields one dict per row without reading the whole body into memory
+    lines = (line.decode('utf-8-sig') for line in iter(stream.readline, b''))
+    first = next(lines, '')
+    lines = itertools.chain([first], lines)
+    if 'csv' in content_type or ('json' not in content_type and not first.lstrip().startswith('{')):
+        yield from csv.DictReader(lines)
+        return
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+def render_import_rows(rows, label_import, format_type, date):
+    for row_number, row in enumerate(rows):
+        label_import.rows_read = row_number + 1
+        # Rows before START_ROW were printed by an earlier, interrupted import
+        if row_number < label_import.start_row:
+            continue
+        serial_number = row.get('SN')
+        if not serial_number:
+            label_import.skipped += 1
+            continue
+        yield row_number, create_label_data(format_type, serial_number, row.get('MODEL', ''),
+                                            row.get('Model_APN', ''), row.get('TYPE', ''),
+                                            row.get('USER', 'Unknown'), date)
+
+@app.route('/labels/import', methods=['POST'])
+@instrument('/labels/import')
+def import_labels():
+    # Streams a CSV (SN,MODEL,Model_APN,TYPE header) or NDJSON manifest straight
+    # to one printer. START_ROW (0-based) resumes an import after a failure.
+    label_import = None
+    try:
+        mode = request.args.get('MODE', 'IP')
+        printer_connection = resolve_printer(request.args.get('PRINTER', ''), mode)
+        start_row = int(request.args.get('START_ROW', 0))
+        import_id = request.args.get('IMPORT_ID') or uuid.uuid4().hex
+        if not printer_connection:
+            return jsonify({"status": "error", "message": "No printer provided"}), 400
+
+        label_import = LabelImport(import_id, printer_connection, mode, start_row)
+        shared('import', label_import.to_dict())
+
+        logging.info("Starting label import %s to %s from row %d", import_id, printer_connection, start_row)
+        target = printer_target(mode, printer_connection)
+        rows = read_import_rows(request.stream, request.content_type or '')
+        labels = render_import_rows(rows, label_import, resolve_format_type(mode, printer_connection),
+                                    datetime.now().strftime('%Y-%m-%d'))
+
+        while True:
+            chunk = list(itertools.islice(labels, IMPORT_CHUNK_SIZE))
+            if not chunk:
+                break
+            outcomes = send_in_lane(target, [data for _, data in chunk], mode)
+            for (row_number, _), (success, error) in zip(chunk, outcomes):
+                if not success:
+                    label_import.state = 'failed'
+                    label_import.error = error
+                    break
+                label_import.printed += 1
+                label_import.next_row = row_number + 1
+            if label_import.state == 'failed':
+                break
+            shared('import', label_import.to_dict())
+
+        if label_import.state != 'failed':
+            label_import.state = 'done'
+            label_import.next_row = label_import.rows_read
+        label_import.finished_at = time.time()
+        shared('import', label_import.to_dict())
+        logging.info("Label import %s %s: %d printed, resume from row %d", import_id,
+                     label_import.state, label_import.printed, label_import.next_row)
+
+        if label_import.state == 'failed':
+            return jsonify({"status": "error", "message": label_import.error, "import": label_import.to_dict()}), 500
+        return jsonify({"status": "success", "import": label_import.to_dict()})
+
+    except Exception as e:
+        if label_import is not None:
+            label_import.state = 'failed'
+            label_import.error = str(e)
+            label_import.finished_at = time.time()
+            shared('import', label_import.to_dict())
+        logging.error(f"Error processing label import: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/labels/import/<import_id>', methods=['GET'])
+def import_status(import_id):
+    label_import = shared('import_state', import_id)
+    if label_import is None:
+        return jsonify({"status": "error", "message": f"Unknown import {import_id}"}), 404
+    return jsonify({"status": "success", "import": label_import})
+
 @app.route('/getLabelSize', methods=['GET'])
 def get_label_size():
     try:
         mode = request.args.get('MODE', 'IP')
-        format_type = request.args.get('FORMAT', '5')
+        printer_connection = request.args.get('PRINTER', '')
+        profile = printer_profile(mode, printer_connection)
+        format_type = request.args.get('FORMAT') or profile['template']
         template = TEMPLATES.get(format_type, TEMPLATES['5'])
-        return jsonify({"labelSize": template['size']})
+        return jsonify({"labelSize": template['size'], "profile": profile})
     except Exception as e:
         logging.error(f"Error getting label size: {str(e)}")
         return jsonify({"status": "error", "message": f"Failed to get label size: {str(e)}"}), 500
 
 def create_square_icon():
+    from PIL import Image, ImageDraw, ImageFont
     icon_path = r"C:\Users\YOUR_NAME\Desktop\Projects\printer-app\app\icons\icon128.png"
     try:
         if os.path.exists(icon_path):
@@ -193,11 +2103,13 @@ def toggle_server():
     return "Stop Server" if server_running else "Start Server"
 
 def show_info():
+    import ctypes
     ctypes.windll.user32.MessageBoxW(0, 
         "Printer Server v3.0\nStatus: Running\nNetwork QL Series: 62mm\nUSB PT-9xx Series: 36mm\nUSB PT-7xx Series: 24mm", 
         "Printer Server Info", 0)
 
 def show_instructions():
+    import ctypes
     ctypes.windll.user32.MessageBoxW(0,
         "Printer Setup Guide:\n\n"
         "For detailed instructions visit:\n"
@@ -217,6 +2129,7 @@ def show_instructions():
         "Printer Setup Instructions", 0)
 
 def create_system_tray():
+    import pystray
     icon_image = create_square_icon()
     menu = (
         pystray.MenuItem("Info", show_info),
@@ -229,6 +2142,7 @@ def create_system_tray():
 
 def add_to_startup():
     try:
+        import winreg
         key_path = r"Software\Microsoft\Windows\CurrentVersion\Run"
         key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, key_path, 0, 
                             winreg.KEY_ALL_ACCESS)
@@ -239,15 +2153,154 @@ def add_to_startup():
         logging.error(f"Failed to add to startup: {str(e)}")
         pass
 
-def run_flask():
-    app.run(host='0.0.0.0', port=3000)
+def ready():
+    global startup_seconds
+    startup_seconds = time.perf_counter() - import_started
+    logging.info(f"Started in {startup_seconds * 1000:.0f} ms (imports {import_seconds * 1000:.0f} ms)")
+
+def run_flask(settings=None, sockets=None):
+    settings = settings or parse_server_args([])
+    ready()
+    if settings.server == 'waitress' or sockets:
+        try:
+            from waitress import serve
+        except ImportError:
+            logging.error("waitress is not installed, falling back to the Flask development server")
+        else:
+            logging.info(f"Serving with waitress on {settings.host}:{settings.port} "
+                         f"(threads={settings.threads}, keep_alive={settings.keep_alive}s, "
+                         f"connection_limit={settings.connection_limit})")
+            listen = {'sockets': sockets} if sockets else {'host': settings.host, 'port': settings.port}
+            serve(app, **listen, threads=settings.threads,
+                  channel_timeout=settings.keep_alive, connection_limit=settings.connection_limit,
+                  backlog=settings.backlog, ident='Printer Server')
+            return
+
+    logging.info(f"Serving with the Flask development server on {settings.host}:{settings.port}")
+    app.run(host=settings.host, port=settings.port, threaded=True)
+
+def run_workers(settings):
+    # Every worker binds the port with SO_REUSEPORT and the kernel spreads
+    # connections across them. Workers parse requests and render labels; this
+    # process owns the job queue, spool, recent labels and imports as well as
+    # the printer sockets, pool and health checks, so any worker can answer
+    # for any job.
+    try:
+        import waitress
+    except ImportError:
+        logging.error("--workers needs waitress, serving from a single process")
+        return run_flask(settings)
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        logging.error("--workers needs SO_REUSEPORT (Linux), serving from a single process")
+        return run_flask(settings)
+
+    context = multiprocessing.get_context('spawn')
+    log_queue = context.Queue()
+    worker_logs = QueueListener(log_queue, *log_listener.handlers, respect_handler_level=True)
+    worker_logs.start()
+    atexit.register(worker_logs.stop)
+    owner = PrinterOwner()
+    events.forward = owner.broadcast
+    workers = {}
+
+    def start(index):
+        conn, child_conn = context.Pipe()
+        process = context.Process(target=worker_main, args=(index, settings, child_conn, log_queue),
+                                  daemon=True, name=f"label-worker-{index}")
+        process.start()
+        child_conn.close()
+        threading.Thread(target=owner.serve, args=(conn,), daemon=True, name=f"owner-conn-{index}").start()
+        workers[index] = process
+
+    for index in range(settings.workers):
+        start(index)
+    logging.info(f"Started {settings.workers} worker processes on {settings.host}:{settings.port}")
+    ready()
+    while True:
+        time.sleep(WORKER_RESTART_DELAY)
+        for index, process in list(workers.items()):
+            if not process.is_alive():
+                logging.error(f"Worker {index} exited with code {process.exitcode}, restarting")
+                start(index)
+
+def worker_main(index, settings, conn, log_queue):
+    global printer_owner
+    # Records go to the supervisor's log listener so only one process writes
+    # and rotates the log file
+    log_listener.stop()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in log_listener.handlers:
+        handler.close()
+    root.addHandler(QueueHandler(log_queue))
+
+    apply_settings(settings)
+    printer_owner = PrinterOwnerClient(conn)
+    events.remote = printer_owner.call
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((settings.host, settings.port))
+    run_flask(settings, sockets=[sock])
+
+def run_server(settings):
+    if settings.workers > 1:
+        run_workers(settings)
+    else:
+        run_flask(settings)
+
+def apply_settings(settings):
+    global COALESCE_WINDOW, COALESCE_MAX_BATCH, LOG_PAYLOADS
+    COALESCE_WINDOW = settings.coalesce_window
+    COALESCE_MAX_BATCH = settings.coalesce_max_batch
+    if settings.log_payloads:
+        LOG_PAYLOADS = True
+        logging.getLogger().setLevel(logging.DEBUG)
+
+def parse_server_args(argv=None):
+    parser = argparse.ArgumentParser(description="Label printer server")
+    parser.add_argument('--server', choices=['waitress', 'dev'], default=SERVER_MODE,
+                        help="waitress: multi-threaded production WSGI server, dev: Flask development server")
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS,
+                        help="Worker threads handling requests (waitress)")
+    parser.add_argument('--keep-alive', type=int, default=SERVER_KEEP_ALIVE,
+                        help="Seconds an idle or stalled client connection is kept open (waitress)")
+    parser.add_argument('--connection-limit', type=int, default=SERVER_CONNECTION_LIMIT,
+                        help="Maximum simultaneous client connections (waitress)")
+    parser.add_argument('--backlog', type=int, default=SERVER_BACKLOG,
+                        help="Pending connections queued by the listening socket (waitress)")
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS,
+                        help="HTTP worker processes sharing the port (Linux, waitress); printers stay in one process")
+    parser.add_argument('--coalesce-window', type=float, default=COALESCE_WINDOW,
+                        help="Seconds to gather concurrent labels for one printer into one transmission (0 disables)")
+    parser.add_argument('--coalesce-max-batch', type=int, default=COALESCE_MAX_BATCH,
+                        help="Most labels sent in one coalesced transmission")
+    parser.add_argument('--spool-file', default=SPOOL_FILE,
+                        help="Durable job spool replayed at startup")
+    parser.add_argument('--no-spool', action='store_true', help="Keep queued jobs in memory only")
+    parser.add_argument('--headless', action='store_true',
+                        help="Serve without the tray icon or the Windows startup entry (Linux hosts, services)")
+    parser.add_argument('--log-payloads', action='store_true',
+                        help=f"Log label bodies at DEBUG level, truncated to {LOG_PAYLOAD_LIMIT} bytes")
+    return parser.parse_args(argv)
 
 if __name__ == '__main__':
     try:
-        add_to_startup()
-        icon = create_system_tray()
-        flask_thread = threading.Thread(target=run_flask, daemon=True)
-        flask_thread.start()
-        icon.run()
+        settings = parse_server_args()
+        apply_settings(settings)
+        if SPOOL_ENABLED and not settings.no_spool:
+            open_spool(settings.spool_file)
+        if settings.headless:
+            run_server(settings)
+        else:
+            add_to_startup()
+            icon = create_system_tray()
+            flask_thread = threading.Thread(target=run_server, args=(settings,), daemon=True)
+            flask_thread.start()
+            icon.run()
     except Exception as e:
         logging.error(f"Failed to start server: {str(e)}")
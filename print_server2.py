@@ -1,18 +1,23 @@
+import time
+import_started = time.perf_counter()
+
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import socket
-from brother_ql.raster import BrotherQLRaster
-from brother_ql.backends.helpers import send
-from brother_ql.backends import backend_factory
+import json
+import string
+import re
 import logging
 from datetime import datetime
-from urllib.parse import parse_qs, urlparse
-import pystray
-from PIL import Image, ImageDraw, ImageFont
+import argparse
 import threading
 import os
 import sys
-import winreg
+from collections import OrderedDict
+
+# brother_ql is imported on the first USB job, and pystray, PIL, winreg and
+# ctypes only for the Windows tray, so --headless starts fast and runs anywhere
+import_seconds = time.perf_counter() - import_started
 
 # Set up logging
 logging.basicConfig(
@@ -31,37 +36,176 @@ connection_type = "IP"
 
 # Template configurations
 TEMPLATES = {
-    '2': {'size': '24mm', 'dpi': '180x180'},  # For PT-P7* series (USB only)
-    '3': {'size': '36mm', 'dpi': '300x300'},
-    '4': {'size': 'A4', 'dpi': '300x300'},
-    '6': {'size': '62mm', 'dpi': '300x300'}
+    '2': {'size': '24mm', 'dpi': '180x180', 'layout': '24mm'},  # For PT-P7* series (USB only)
+    '3': {'size': '36mm', 'dpi': '300x300', 'layout': '36mm'},
+    '4': {'size': 'A4', 'dpi': '300x300', 'layout': 'A4'},
+    '6': {'size': '62mm', 'dpi': '300x300', 'layout': '62mm', 'label': '62'}
+}
+# 'label' is the brother_ql media a template prints on over USB. brother_ql
+# 0.9.4 only has QL media, so the 24mm and 36mm tapes have none yet.
+
+# Printer profiles, keyed by series and first model digit so 'PT-7' covers the
+# PT-P700, PT-P710BT and PT-P750W, or by the first two digits where models of
+# a series differ ('QL-82' is the QL-820NWB), and indexed by USB product id.
+# 'formats' are the templates a printer can take, 'template' is its default.
+# compression: PackBits raster compression, the QL-800 does not support it.
+# brother_ql 0.9.4 has no PT models, so PT-7 USB jobs fail with a clear error.
+PRINTER_PROFILES = {
+    'QL-8': {'model': 'QL-800', 'usb_product': '0x209b', 'template': '6', 'formats': ['6'],
+             'dpi': '300x300', 'protocol': 'raster', 'compression': False},
+    'QL-81': {'model': 'QL-810W', 'usb_product': '0x209c', 'template': '6', 'formats': ['6'],
+              'dpi': '300x300', 'protocol': 'raster', 'compression': True},
+    'QL-82': {'model': 'QL-820NWB', 'usb_product': '0x209d', 'template': '6', 'formats': ['6'],
+              'dpi': '300x300', 'protocol': 'raster', 'compression': True},
+    'PT-7': {'model': 'PT-P750W', 'usb_product': '0x2060', 'template': '2', 'formats': ['2'],
+             'dpi': '180x180', 'protocol': 'raster', 'compression': True}
+}
+DEFAULT_PROFILE = 'QL-8'
+PRINTER_MODEL = re.compile(r'\b(QL|PT)-?P?(\d)(\d)\d{1,2}', re.IGNORECASE)
+USB_PRODUCT = re.compile(r'0x04f9:(0x[0-9a-f]{4})', re.IGNORECASE)
+PROFILE_CACHE_SIZE = 1024      # Printer strings whose resolved profile is remembered
+
+# USB labels are drawn as a bitmap: the SN, its Code 128 barcode and these
+# lines. Sizes are for the 696 dot 62mm head, like the 62mm ZPL layout.
+LABEL_FONT = 'arial.ttf'
+LABEL_BARCODE_HEIGHT = 100
+USB_LABEL_LINES = [
+    ('Model', 'model', 36),
+    ('APN', 'model_apn', 36),
+    ('Type', 'type_name', 36),
+    ('Printed by', 'username', 26),
+    ('Date', 'date', 26)
+]
+
+# Code 128 bar and space widths of symbol values 0-106 (103-105 start, 106 stop)
+CODE128 = """212222 222122 222221 121223 121322 131222 122213 122312 132212 221213
+221312 231212 112232 122132 122231 113222 123122 123221 223211 221132
+221231 213212 223112 312131 311222 321122 321221 312212 322112 322211
+212123 212321 232121 111323 131123 131321 112313 132113 132311 211313
+231113 231311 112133 112331 132131 113123 113321 133121 313121 211331
+231131 213113 213311 213131 311123 311321 331121 312113 312311 332111
+314111 221411 431111 111224 111422 121124 121421 141122 141221 112214
+112412 122114 122411 142112 142211 241211 221114 413111 241112 134111
+111242 121142 121241 114212 124112 124211 411212 421112 421211 212141
+214121 412121 111143 111341 131141 114113 114311 411113 411311 113141
+114131 311141 411131 211412 211214 211232 2331112""".split()
+CODE128_START_B = 104
+
+APP_DIR = os.path.dirname(sys.executable if getattr(sys, 'frozen', False) else os.path.abspath(__file__))
+TEMPLATES_FILE = os.path.join(APP_DIR, 'print_server2_templates.json')
+FIELD_ESCAPES = str.maketrans({'^': ' ', '~': ' ', '\n': ' ', '\r': ' '})
+FIELD_SPECIALS = re.compile('[\\^~\\r\\n]')
+
+# Label layouts are plain str.format templates, compiled once at startup into
+# pre-encoded bytes. More layouts and templates can be added in
+# print_server2_templates.json next to the executable:
+#   {"layouts": {"name": "^XA...{serial_number}...^XZ"},
+#    "templates": {"7": {"size": "29mm", "dpi": "300x300", "layout": "name"}}}
+LABEL_LAYOUTS = {
+    '24mm': ("^XA^FO20,10^A0N,20,20^FD{serial_number}^FS"
+             "^FO20,35^BCN,40,N,N,N^FD{serial_number}^FS"
+             "^FO20,80^A0N,15,15^FD{model}^FS^XZ"),
+    '36mm': ("^XA^FO30,10^A0N,25,25^FD{serial_number}^FS"
+             "^FO30,40^BCN,60,N,N,N^FD{serial_number}^FS"
+             "^FO30,110^A0N,20,20^FD{model}^FS^XZ"),
+    'A4': ("^XA^FO100,100^A0N,70,70^FD{serial_number}^FS"
+           "^FO100,200^BCN,150,Y,N,N^FD{serial_number}^FS"
+           "^FO100,400^A0N,40,40^FDModel: {model}^FS"
+           "^FO100,450^A0N,40,40^FDAPN: {model_apn}^FS"
+           "^FO100,500^A0N,40,40^FDType: {type_name}^FS"
+           "^FO100,550^A0N,30,30^FDPrinted by: {username}^FS"
+           "^FO100,600^A0N,30,30^FDDate: {date}^FS^XZ"),
+    '62mm': ("^XA^FO50,50^A0N,50,50^FD{serial_number}^FS"
+             "^FO50,120^BCN,100,Y,N,N^FD{serial_number}^FS"
+             "^FO50,250^A0N,30,30^FDModel: {model}^FS"
+             "^FO50,290^A0N,30,30^FDAPN: {model_apn}^FS"
+             "^FO50,330^A0N,30,30^FDType: {type_name}^FS"
+             "^FO50,370^A0N,20,20^FDPrinted by: {username}^FS"
+             "^FO50,400^A0N,20,20^FDDate: {date}^FS^XZ")
 }
 
+class LabelTemplate:
+    def __init__(self, source):
+        # The layout is compiled into one bytes %-format with a %b slot per field
+        pattern = []
+        self.fields = []
+        for literal, field, _, _ in string.Formatter().parse(source):
+            pattern.append(literal.encode('utf-8').replace(b'%', b'%%'))
+            if field is not None:
+                pattern.append(b'%b')
+                self.fields.append(field)
+        self.pattern = b''.join(pattern)
+
+    def render(self, fields):
+        values = [str(fields.get(name, '')) for name in self.fields]
+        # ^ and ~ start ZPL commands and would break the label if left in a field
+        if FIELD_SPECIALS.search('\0'.join(values)):
+            values = [value.translate(FIELD_ESCAPES) for value in values]
+        return self.pattern % tuple([value.encode('utf-8') for value in values])
+
+def load_label_templates(path=TEMPLATES_FILE):
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        LABEL_LAYOUTS.update(config.get('layouts', {}))
+        TEMPLATES.update(config.get('templates', {}))
+        PRINTER_PROFILES.update(config.get('profiles', {}))
+        logging.info(f"Loaded label templates from {path}")
+    except Exception as e:
+        logging.error(f"Failed to load label templates from {path}: {str(e)}")
+
+def compile_label_templates():
+    layouts = {name: LabelTemplate(source) for name, source in LABEL_LAYOUTS.items()}
+    return {format_type: layouts[template.get('layout', '62mm')]
+            for format_type, template in TEMPLATES.items()}
+
+load_label_templates()
+label_templates = compile_label_templates()
+usb_products = {profile['usb_product'].lower(): key
+                for key, profile in PRINTER_PROFILES.items() if profile.get('usb_product')}
+resolved_profiles = OrderedDict()
+
+def printer_profile(mode, printer_name):
+    # Resolved once per printer string, later lookups are a single dict hit
+    profile = resolved_profiles.get((mode, printer_name))
+    if profile is None:
+        name = printer_name or ''
+        match = PRINTER_MODEL.search(name)
+        key = None
+        if match:
+            series = match.group(1).upper()
+            key = f"{series}-{match.group(2)}{match.group(3)}"
+            if key not in PRINTER_PROFILES:
+                key = f"{series}-{match.group(2)}"
+        if key is None and mode == 'USB':
+            product = USB_PRODUCT.search(name)
+            key = usb_products.get(product.group(1).lower()) if product else None
+        if key not in PRINTER_PROFILES:
+            key = DEFAULT_PROFILE
+        profile = resolved_profiles[(mode, printer_name)] = {'key': key, **PRINTER_PROFILES[key]}
+        if len(resolved_profiles) > PROFILE_CACHE_SIZE:
+            resolved_profiles.popitem(last=False)
+    return profile
+
+def resolve_format_type(mode, printer_name, requested=None):
+    profile = printer_profile(mode, printer_name)
+    # Roll printers take any of their formats, tape printers only their own
+    if mode == 'USB' and requested in profile['formats']:
+        return requested
+    return profile['template']
+
 def create_label_data(template_format, serial_number, model, model_apn, type_name, username, date):
-    if template_format == '2':  # 24mm (PT-P7* series)
-        return (f"^XA^FO20,10^A0N,20,20^FD{serial_number}^FS"
-                f"^FO20,35^BCN,40,N,N,N^FD{serial_number}^FS"
-                f"^FO20,80^A0N,15,15^FD{model}^FS^XZ")
-    elif template_format == '3':  # 36mm
-        return (f"^XA^FO30,10^A0N,25,25^FD{serial_number}^FS"
-                f"^FO30,40^BCN,60,N,N,N^FD{serial_number}^FS"
-                f"^FO30,110^A0N,20,20^FD{model}^FS^XZ")
-    elif template_format == '4':  # A4
-        return (f"^XA^FO100,100^A0N,70,70^FD{serial_number}^FS"
-                f"^FO100,200^BCN,150,Y,N,N^FD{serial_number}^FS"
-                f"^FO100,400^A0N,40,40^FDModel: {model}^FS"
-                f"^FO100,450^A0N,40,40^FDAPN: {model_apn}^FS"
-                f"^FO100,500^A0N,40,40^FDType: {type_name}^FS"
-                f"^FO100,550^A0N,30,30^FDPrinted by: {username}^FS"
-                f"^FO100,600^A0N,30,30^FDDate: {date}^FS^XZ")
-    else:  # format 6 - 62mm
-        return (f"^XA^FO50,50^A0N,50,50^FD{serial_number}^FS"
-                f"^FO50,120^BCN,100,Y,N,N^FD{serial_number}^FS"
-                f"^FO50,250^A0N,30,30^FDModel: {model}^FS"
-                f"^FO50,290^A0N,30,30^FDAPN: {model_apn}^FS"
-                f"^FO50,330^A0N,30,30^FDType: {type_name}^FS"
-                f"^FO50,370^A0N,20,20^FDPrinted by: {username}^FS"
-                f"^FO50,400^A0N,20,20^FDDate: {date}^FS^XZ")
+    template = label_templates.get(template_format, label_templates['6'])
+    return template.render({
+        'serial_number': serial_number,
+        'model': model,
+        'model_apn': model_apn,
+        'type_name': type_name,
+        'username': username,
+        'date': date
+    })
 
 def send_to_network_printer(printer_ip, data):
     try:
@@ -73,7 +217,7 @@ def send_to_network_printer(printer_ip, data):
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.settimeout(5)
             s.connect((printer_ip, printer_port))
-            s.sendall(data.encode('utf-8'))
+            s.sendall(data)
         logging.info(f"Successfully sent data to printer at {printer_ip}:{printer_port}")
         return True
     except socket.timeout:
@@ -83,34 +227,224 @@ def send_to_network_printer(printer_ip, data):
         logging.error(f"Failed to send data to printer at {printer_ip}: {str(e)}")
         return False
 
-def send_to_usb_printer(printer_name, data, template_format):
-    try:
-        is_ptp7_series = printer_name.startswith('Brother PT-P7')
-        
-        if is_ptp7_series:
-            qlr = BrotherQLRaster('PT-P750W')
-            template_config = TEMPLATES['2']
-        else:
-            qlr = BrotherQLRaster('QL-800')
-            template_config = TEMPLATES.get(template_format, TEMPLATES['6'])
-        
-        qlr.exception_on_warning = True
-        
-        if hasattr(qlr, 'set_label_size'):
-            qlr.set_label_size(template_config['size'])
+class USBPrinter:
+    def __init__(self, identifier):
+        self.identifier = identifier
+        self.lock = threading.Lock()
+        self.handle = None
+        self.rasters = {}
+        self.jobs = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    def raster(self, model):
+        # One raster builder per model, only the job data is reset
+        qlr = self.rasters.get(model)
+        if qlr is None:
+            from brother_ql.raster import BrotherQLRaster
+            from brother_ql.models import ALL_MODELS
+            spec = next((spec for spec in ALL_MODELS if spec.identifier == model), None)
+            if spec is None:
+                raise ValueError(f"brother_ql has no raster support for the {model}")
+            qlr = self.rasters[model] = BrotherQLRaster(model)
+            qlr.exception_on_warning = True
+            qlr.spec = spec
+        qlr.data = b''
+        return qlr
+
+    def close(self):
+        if self.handle is not None:
+            try:
+                self.handle.dispose()
+            except Exception:
+                pass
+            self.handle = None
+
+class USBPrinterManager:
+    # Opens each USB identifier once and keeps the handle between jobs. Writes
+    # to one device are serialized while other devices print concurrently.
+    def __init__(self, backend_identifier='pyusb'):
+        self.backend_identifier = backend_identifier
+        self.backend_class = None
+        self.lock = threading.Lock()
+        self.printers = {}
+
+    def printer(self, identifier):
+        with self.lock:
+            if self.backend_class is None:
+                from brother_ql.backends import backend_factory
+                self.backend_class = backend_factory(self.backend_identifier)['backend_class']
+            printer = self.printers.get(identifier)
+            if printer is None:
+                printer = self.printers[identifier] = USBPrinter(identifier)
+            return printer
+
+    def open(self, printer):
+        printer.handle = self.backend_class(printer.identifier)
+        logging.info(f"Opened USB printer {printer.identifier}")
+
+    def print_label(self, identifier, model, label_name, fields, compression=False):
+        from brother_ql.labels import FormFactor
+        printer = self.printer(identifier)
+        with printer.lock:
+            qlr = printer.raster(model)
+            media = usb_label(label_name)
+            image = render_label_image(media, qlr, fields)
+            compression = compression and qlr.spec.compression
+
+            # The command sequence of brother_ql.conversion.convert for one
+            # black page: invalidate, initialize, media, raster rows, print
+            qlr.add_invalidate()
+            qlr.add_initialize()
+            if qlr.spec.mode_setting:
+                qlr.add_switch_mode()
+            qlr.add_status_information()
+            qlr.mtype = 0x0A if media.form_factor == FormFactor.ENDLESS else 0x0B
+            qlr.mwidth, qlr.mlength = media.tape_size
+            qlr.add_media_and_quality(image.size[1])
+            if qlr.spec.cutting:
+                qlr.add_autocut(True)
+                qlr.add_cut_every(1)
+            if qlr.spec.expanded_mode:
+                qlr.add_expanded_mode()
+            qlr.add_margins(media.feed_margin)
+            if compression:
+                qlr.add_compression(True)
+            raster_start = len(qlr.data)
+            qlr.add_raster_data(image)
+            qlr.add_print()
+            raw_size = uncompressed_size(qlr, raster_start) if compression else len(qlr.data)
+
+            if printer.handle is None:
+                self.open(printer)
+            try:
+                printer.handle.write(qlr.data)
+            except Exception as e:
+                # The device was unplugged or reset, reopen it once and resend
+                logging.info(f"USB printer {identifier} went away ({str(e)}), reconnecting")
+                printer.close()
+                self.open(printer)
+                printer.handle.write(qlr.data)
+
+            printer.jobs += 1
+            printer.raw_bytes += raw_size
+            printer.sent_bytes += len(qlr.data)
+            if compression:
+                logging.info(f"USB printer {identifier}: sent {len(qlr.data)} bytes "
+                             f"({raw_size} uncompressed, {len(qlr.data) / max(raw_size, 1):.0%})")
+
+    def stats(self):
+        with self.lock:
+            printers = list(self.printers.values())
+        return {printer.identifier: {
+            "jobs": printer.jobs,
+            "raw_bytes": printer.raw_bytes,
+            "sent_bytes": printer.sent_bytes,
+            "ratio": round(printer.sent_bytes / printer.raw_bytes, 3) if printer.raw_bytes else None
+        } for printer in printers}
+
+    def close_all(self):
+        with self.lock:
+            for printer in self.printers.values():
+                with printer.lock:
+                    printer.close()
+
+def uncompressed_size(qlr, start):
+    # Raster lines are 'g' 0x00 <length> <row>; a PackBits row always expands
+    # to the printer's full row width
+    row_bytes = qlr.get_pixel_width() // 8
+    data = qlr.data
+    index = start
+    rows = 0
+    packed = 0
+    while data[index:index + 2] == b'\x67\x00' and index + 2 < len(data):
+        length = data[index + 2]
+        rows += 1
+        packed += length
+        index += 3 + length
+    return len(data) - packed + rows * row_bytes
+
+def usb_label(label_name):
+    from brother_ql.labels import ALL_LABELS
+    media = next((media for media in ALL_LABELS if media.identifier == label_name), None)
+    if media is None:
+        raise ValueError(f"brother_ql has no {label_name} media")
+    return media
+
+label_fonts = {}
+
+def label_font(size):
+    font = label_fonts.get(size)
+    if font is None:
+        from PIL import ImageFont
+        try:
+            font = ImageFont.truetype(LABEL_FONT, size)
+        except OSError:
+            font = ImageFont.load_default(size)
+        label_fonts[size] = font
+    return font
+
+def code128_widths(text):
+    # Code set B covers printable ASCII, anything else is sent as '?'
+    values = [ord(char) - 32 if 32 <= ord(char) < 128 else ord('?') - 32 for char in text]
+    checksum = (CODE128_START_B + sum(position * value for position, value in enumerate(values, 1))) % 103
+    return ''.join(CODE128[value] for value in [CODE128_START_B, *values, checksum, 106])
+
+def draw_code128(draw, text, x, y, max_width, height):
+    # Bars are whole dots wide, up to 4 per module, and the symbol keeps a
+    # 10 module quiet zone on each side
+    widths = code128_widths(text)
+    module = min(max(max_width // (sum(map(int, widths)) + 20), 1), 4)
+    x += 10 * module
+    for index, width in enumerate(widths):
+        if index % 2 == 0:
+            draw.rectangle((x, y, x + int(width) * module - 1, y + height - 1), fill=0)
+        x += int(width) * module
+
+def render_label_image(media, qlr, fields):
+    # USB printers take a bitmap, not ZPL: the fields of the 62mm layout with
+    # the SN barcode, drawn at the media's printable width and padded to the
+    # print head's full width
+    from PIL import Image, ImageDraw, ImageOps
+    width = media.dots_printable[0]
+    scale = width / 696
+    lines = [(fields['serial_number'], 64), (None, LABEL_BARCODE_HEIGHT)]
+    lines += [(f"{title}: {fields[name]}", size) for title, name, size in USB_LABEL_LINES if fields.get(name)]
+    lines = [(text, max(int(size * scale), 10)) for text, size in lines]
+    margin = int(20 * scale)
+    height = max(media.dots_printable[1], sum(int(size * 1.25) for _, size in lines) + 2 * margin)
+
+    canvas = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(canvas)
+    y = margin
+    for text, size in lines:
+        if text is None:
+            draw_code128(draw, fields['serial_number'], margin, y, width - 2 * margin, size)
         else:
-            qlr.label_size = template_config['size']
-        
-        qlr.add_text(data)
-        
-        backend = backend_factory('pyusb')
-        
-        if is_ptp7_series:
-            identifier = 'usb://0x04f9:0x2060'
+            draw.text((margin, y), text, fill=0, font=label_font(size))
+        y += int(size * 1.25)
+
+    page = Image.new('L', (qlr.get_pixel_width(), height), 0)
+    offset = media.offset_r + qlr.spec.additional_offset_r
+    page.paste(ImageOps.invert(canvas), (page.size[0] - width - offset, 0))
+    return page.point(lambda value: 255 if value > 127 else 0, mode='1')
+
+usb_printers = USBPrinterManager()
+
+def send_to_usb_printer(printer_name, fields, template_format):
+    try:
+        profile = printer_profile('USB', printer_name)
+        template_config = TEMPLATES.get(resolve_format_type('USB', printer_name, template_format), TEMPLATES['6'])
+        if 'label' not in template_config:
+            raise ValueError(f"No USB media configured for {template_config['size']} labels")
+        # Names like QL-820NWB don't address a device, the product id does
+        if not USB_PRODUCT.search(printer_name or ''):
+            identifier = f"usb://0x04f9:{profile['usb_product']}"
         else:
-            identifier = f"usb://{printer_name}" if printer_name else 'usb://0x04f9:0x209b'
-        
-        send(qlr.data, backend, printer_identifier=identifier, blocking=True)
+            identifier = f"usb://{printer_name}"
+
+        usb_printers.print_label(identifier, profile['model'], template_config['label'], fields,
+                                 profile['compression'])
         logging.info(f"Successfully sent data to USB printer {printer_name}")
         return True
         
@@ -120,7 +454,11 @@ def send_to_usb_printer(printer_name, data, template_format):
 
 @app.route('/', methods=['GET'])
 def health_check():
-    return jsonify({"status": "running", "timestamp": datetime.now().isoformat()})
+    return jsonify({
+        "status": "running",
+        "timestamp": datetime.now().isoformat(),
+        "usb": usb_printers.stats()
+    })
 
 @app.route('/label', methods=['GET'])
 def label():
@@ -133,25 +471,26 @@ def label():
         mode = request.args.get('MODE', 'IP')
         
         # Set format based on mode and printer type
-        if mode == 'USB' and printer_ip.startswith('Brother PT-P7'):
-            format_type = '2'
-        elif mode == 'IP':
-            format_type = '6'
-        else:
-            format_type = request.args.get('FORMAT', '6')
+        format_type = resolve_format_type(mode, printer_ip, request.args.get('FORMAT'))
         
         username = request.args.get('USER', 'Unknown')
-        date = request.now().strftime('%Y-%m-%d')
+        date = datetime.now().strftime('%Y-%m-%d')
         
         if not serial_number:
             return jsonify({"status": "error", "message": "No serial number provided"}), 400
             
-        data = create_label_data(format_type, serial_number, model, model_apn, type_name, username, date)
-        
         if mode == 'IP':
+            data = create_label_data(format_type, serial_number, model, model_apn, type_name, username, date)
             success = send_to_network_printer(printer_ip, data)
         else:
-            success = send_to_usb_printer(printer_ip, data, format_type)
+            success = send_to_usb_printer(printer_ip, {
+                'serial_number': serial_number,
+                'model': model,
+                'model_apn': model_apn,
+                'type_name': type_name,
+                'username': username,
+                'date': date
+            }, format_type)
             
         if success:
             return jsonify({"status": "success"})
@@ -166,19 +505,16 @@ def get_label_size():
     try:
         printer_ip = request.args.get('printerIP')
         mode = request.args.get('MODE', 'IP')
-        format_type = request.args.get('FORMAT', '6')
+        format_type = resolve_format_type(mode, printer_ip, request.args.get('FORMAT'))
+        template = TEMPLATES.get(format_type, TEMPLATES['6'])
         
-        if mode == 'USB' and printer_ip.startswith('Brother PT-P7'):
-            template = TEMPLATES['2']
-        else:
-            template = TEMPLATES.get(format_type, TEMPLATES['6'])
-        
-        return jsonify({"labelSize": template['size']})
+        return jsonify({"labelSize": template['size'], "profile": printer_profile(mode, printer_ip)})
     except Exception as e:
         logging.error(f"Error getting label size: {str(e)}")
         return jsonify({"status": "error", "message": f"Failed to get label size: {str(e)}"}), 500
 
 def create_square_icon():
+    from PIL import Image, ImageDraw, ImageFont
     size = (64, 64)
     icon = Image.new('RGBA', size, (0, 0, 0, 0))
     draw = ImageDraw.Draw(icon)
@@ -203,16 +539,19 @@ def toggle_server():
     return "Stop Server" if server_running else "Start Server"
 
 def show_info():
+    import ctypes
     ctypes.windll.user32.MessageBoxW(0, 
         "Printer Server v2.0\nStatus: Running\nNetwork (IP): 62mm\nUSB: 24mm (PT-P7* series)", 
         "Printer Server Info", 0)
 
 def show_instructions():
+    import ctypes
     ctypes.windll.user32.MessageBoxW(0,
         "1. Choose IP or USB mode\n2. Enter printer address/name\n3. Save settings\n4. Print",
         "Instructions", 0)
 
 def create_system_tray():
+    import pystray
     icon_image = create_square_icon()
     menu = (
         pystray.MenuItem("Info", show_info),
@@ -225,6 +564,7 @@ def create_system_tray():
 
 def add_to_startup():
     try:
+        import winreg
         key_path = r"Software\Microsoft\Windows\CurrentVersion\Run"
         key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, key_path, 0, 
                             winreg.KEY_ALL_ACCESS)
@@ -235,15 +575,25 @@ def add_to_startup():
         logging.error(f"Failed to add to startup: {str(e)}")
         pass
 
-def run_flask():
-    app.run(host='0.0.0.0', port=3000)
+def run_flask(port=3000):
+    startup_seconds = time.perf_counter() - import_started
+    logging.info(f"Started in {startup_seconds * 1000:.0f} ms (imports {import_seconds * 1000:.0f} ms)")
+    app.run(host='0.0.0.0', port=port)
 
 if __name__ == '__main__':
     try:
-        add_to_startup()
-        icon = create_system_tray()
-        flask_thread = threading.Thread(target=run_flask, daemon=True)
-        flask_thread.start()
-        icon.run()
+        parser = argparse.ArgumentParser(description="Label printer server")
+        parser.add_argument('--port', type=int, default=3000)
+        parser.add_argument('--headless', action='store_true',
+                            help="Serve without the tray icon or the Windows startup entry (Linux hosts, services)")
+        args = parser.parse_args()
+        if args.headless:
+            run_flask(args.port)
+        else:
+            add_to_startup()
+            icon = create_system_tray()
+            flask_thread = threading.Thread(target=run_flask, args=(args.port,), daemon=True)
+            flask_thread.start()
+            icon.run()
     except Exception as e:
         logging.error(f"Failed to start server: {str(e)}")
@@ -1,27 +1,62 @@
-import pyautogui
 import time
-from PIL import Image, ImageDraw, ImageFont
+import_started = time.perf_counter()
+
 import sys
 import keyboard
 import logging
-from datetime import datetime
 from pystray import Icon, MenuItem, Menu
 from PIL import Image as PILImage
 import threading
-import winreg
 import os
-import threading
-import ctypes
-import tkinter as tk
-from tkinter import ttk, messagebox
-import subprocess
-import shutil
+import importlib
 import json
+import queue
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access"""
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attribute):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attribute)
+
+# The setup GUI and the automation/vision stack load on first use, so the
+# resident tool started from the Run key only loads the hotkey listener and tray
+pyautogui = LazyModule('pyautogui')
+np = LazyModule('numpy')
+tk = LazyModule('tkinter')
+ttk = LazyModule('tkinter.ttk')
+messagebox = LazyModule('tkinter.messagebox')
+import_seconds = time.perf_counter() - import_started
 
 # Global states
 HOTKEY_ENABLED = True
 BASE_URL = "https://your_url/"
 
+# Reference screenshots the automation looks for on screen
+APP_DIR = os.path.dirname(sys.executable if getattr(sys, 'frozen', False) else os.path.abspath(__file__))
+IMAGES_DIR = os.path.join(APP_DIR, 'images')
+MATCH_THRESHOLD = 0.9       # Normalized cross-correlation score that counts as found
+MATCH_COARSE_SIDE = 16      # Smallest template side (px) the coarse pyramid level may shrink to
+MATCH_COARSE_SLACK = 0.2    # How far below the threshold a coarse peak may score and still be refined
+MATCH_EXACT = 0.999         # Refined score that ends the search, nothing else can match better
+MATCH_DIRECT_POSITIONS = 256  # Match positions up to which NCC is computed directly instead of by FFT
+
+# Automation steps, kept next to settings.json
+STEPS_FILE = 'automation_steps.json'
+STEP_TIMEOUT = 10           # Seconds a step waits for the screen before the run is aborted
+STEP_POLL_INTERVAL = 0.05   # Seconds between screen checks while waiting
+CAPTURE_TILE = 64           # Side (px) of the tiles whose hashes detect screen changes
+CHANGE_MIN_PIXELS = 64      # Changed pixels that count as a region change (more than a blinking caret)
+
+# Hotkeys
+RUN_HOTKEY = 'F8'
+CANCEL_HOTKEY = 'F9'
+HOTKEY_DEBOUNCE = 0.5       # Seconds after a run request in which repeats (held key) are ignored
+
 # Define log file path (avoid dynamic timestamps in the file name for executables)
 log_path = os.path.join(os.getenv('APPDATA'), 'RiskAssessmentTool', 'ra_autoclicker.log')
 if not os.path.exists(os.path.dirname(log_path)):
@@ -61,8 +96,6 @@ def main():
     # For testing, we can simulate some actions
     logging.info("Application logic is running in the background.")
 
-if __name__ == "__main__":
-
 # Job Titles List
 JOB_TITLES = [
     "Technician", "Audit Manager", "Cabling Technician", "Construction Manager", "Construction Safety Specialist","Security Manager",
@@ -168,6 +201,7 @@ class SetupGUI:
 
     def install_tool(self):
         try:
+            import shutil
             dest_path = os.path.join(os.getenv('APPDATA'), 'RiskAssessmentTool')
             os.makedirs(dest_path, exist_ok=True)
 
@@ -194,11 +228,13 @@ class SetupGUI:
 
     def add_to_startup(self, install_path):
         try:
+            import winreg
             key_path = r"Software\Microsoft\Windows\CurrentVersion\Run"
             exe_path = os.path.join(install_path, 'risk_assessment_tool.exe')
 
+            # --resident skips the setup checks and goes straight to the hotkey listener
             key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, key_path, 0, winreg.KEY_WRITE)
-            winreg.SetValueEx(key, "RiskAssessmentTool", 0, winreg.REG_SZ, exe_path)
+            winreg.SetValueEx(key, "RiskAssessmentTool", 0, winreg.REG_SZ, f'"{exe_path}" --resident')
             winreg.CloseKey(key)
         except Exception as e:
             messagebox.showwarning("Warning", f"Could not add to startup: {str(e)}")
@@ -211,24 +247,479 @@ class SetupGUI:
 def start_main_tool():
     """Original tool functionality"""
     hide_console()
-    add_to_startup()
-    keyboard.add_hotkey('F8', handle_hotkey)
+    keyboard.add_hotkey(RUN_HOTKEY, handle_hotkey)
+    keyboard.add_hotkey(CANCEL_HOTKEY, cancel_automation)
     icon = create_system_tray()
+    logging.info(f"Resident tool ready in {(time.perf_counter() - import_started) * 1000:.0f} ms "
+                 f"(imports {import_seconds * 1000:.0f} ms)")
     icon.run()
 
 def hide_console():
     """Hide console window on Windows"""
     if sys.platform == 'win32':
+        import ctypes
         ctypes.windll.kernel32.FreeConsole()
 
 def create_system_tray():
     """Create system tray icon using pystray"""
     icon_path = os.path.join(os.path.dirname(sys.executable), "images", "arrowhslogo.ico")
     icon_image = PILImage.open(icon_path)
-    icon = pystray.Icon("Risk Assessment Tool", icon_image, "Risk Assessment Tool")
+    menu = Menu(MenuItem('Cancel automation', cancel_automation), MenuItem('Exit', on_quit))
+    icon = Icon("Risk Assessment Tool", icon_image, "Risk Assessment Tool", menu=menu)
     return icon
 
+# Screen template matching
+def to_gray(image):
+    """PIL image to a float32 grayscale array"""
+    return np.asarray(image.convert('L'), dtype=np.float32)
+
+def window_sums(array, h, w):
+    """Sum of every h x w window, from an integral image"""
+    integral = np.zeros((array.shape[0] + 1, array.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(array, axis=0, dtype=np.float64), axis=1, out=integral[1:, 1:])
+    return integral[h:, w:] - integral[:-h, w:] - integral[h:, :-w] + integral[:-h, :-w]
+
+def downscale(array, factor):
+    """Shrink an array by an integer factor for the coarse search.
+
+    Every coarse pixel averages a 2*factor box, twice the sampling step, so a
+    match that does not line up with the sampling grid still scores close to it.
+    """
+    if factor == 1:
+        return array
+    h, w = array.shape[0] // factor, array.shape[1] // factor
+    blocks = array[:h * factor, :w * factor].reshape(h, factor, w, factor).sum(axis=(1, 3))
+    return (blocks[:-1, :-1] + blocks[1:, :-1] + blocks[:-1, 1:] + blocks[1:, 1:]) / (4 * factor * factor)
+
+def fft_size(n):
+    """Smallest 2^a * 3^b * 5^c >= n, sizes the FFT handles fastest"""
+    best = 1 << (n - 1).bit_length()
+    power3 = 1
+    while power3 < best:
+        power5 = power3
+        while power5 < best:
+            size = power5
+            while size < n:
+                size *= 2
+            best = min(best, size)
+            power5 *= 5
+        power3 *= 3
+    return best
+
+def match_template(image, template):
+    """Normalized cross-correlation of template at every position of image (FFT + integral images)"""
+    th, tw = template.shape
+    ih, iw = image.shape
+    if th > ih or tw > iw:
+        return np.zeros((0, 0), dtype=np.float64)
+    centered = template - template.mean()
+    norm = np.sqrt((centered * centered).sum())
+    if (ih - th + 1) * (iw - tw + 1) <= MATCH_DIRECT_POSITIONS:
+        # A handful of positions, as when refining a coarse peak: a direct
+        # product of every window with the template beats two FFTs
+        windows = np.lib.stride_tricks.sliding_window_view(image, (th, tw))
+        numerator = np.tensordot(windows, centered, axes=2)
+    else:
+        shape = (fft_size(ih + th - 1), fft_size(iw + tw - 1))
+        spectrum = np.fft.rfft2(image, shape) * np.fft.rfft2(centered[::-1, ::-1], shape)
+        numerator = np.fft.irfft2(spectrum, shape)[th - 1:ih, tw - 1:iw]
+
+    sums = window_sums(image, th, tw)
+    variance = window_sums(image * image, th, tw) - sums * sums / (th * tw)
+    denominator = np.sqrt(np.maximum(variance, 0)) * norm
+    scores = np.zeros_like(numerator)
+    np.divide(numerator, denominator, out=scores, where=denominator > 1e-6 * max(norm, 1))
+    return scores
+
+class Template:
+    """A reference image kept as grayscale arrays, with its pyramid levels cached"""
+    def __init__(self, name, array):
+        self.name = name
+        self.array = array
+        self.height, self.width = array.shape
+        self.factor = max(1, min(self.height, self.width) // MATCH_COARSE_SIDE)
+        self.coarse = downscale(array, self.factor)
+
+class TemplateMatcher:
+    """Finds reference images on screen with a coarse-to-fine NCC search"""
+    def __init__(self, images_dir=IMAGES_DIR):
+        self.images_dir = images_dir
+        self.templates = {}
+        self.lock = threading.Lock()
+
+    def template(self, name):
+        """Load a reference image once and keep it in memory"""
+        with self.lock:
+            template = self.templates.get(name)
+            if template is None:
+                path = name if os.path.isabs(name) else os.path.join(self.images_dir, name)
+                with PILImage.open(path) as image:
+                    template = self.templates[name] = Template(name, to_gray(image))
+            return template
+
+    def preload(self, names):
+        """Load reference images before the first lookup needs them"""
+        for name in names:
+            try:
+                self.template(name)
+            except Exception as e:
+                logging.error(f"Could not load reference image {name}: {str(e)}")
+
+    def locate(self, name, frame, region=None, threshold=MATCH_THRESHOLD):
+        """Find a reference image in a grayscale frame.
+
+        region is (left, top, width, height) inside the frame. Returns
+        (left, top, width, height, score) in frame coordinates or None.
+        """
+        template = self.template(name)
+        left, top = 0, 0
+        if region is not None:
+            left, top, width, height = region
+            frame = frame[top:top + height, left:left + width]
+
+        if frame.shape[0] < template.height or frame.shape[1] < template.width:
+            return None
+
+        # Coarse pass on the shrunk frame, then refine every peak that comes
+        # close to the threshold at full resolution in a small window around
+        # it. Repeated controls all peak, and the exact match is not always
+        # the strongest of them at the coarse level.
+        factor = template.factor
+        coarse = match_template(downscale(frame, factor), template.coarse)
+        if coarse.size == 0:
+            return None
+        ch, cw = template.coarse.shape
+
+        best = None
+        while True:
+            y, x = (int(v) for v in np.unravel_index(np.argmax(coarse), coarse.shape))
+            if coarse[y, x] < threshold - MATCH_COARSE_SLACK:
+                break
+            # Suppress a template-sized area so the next candidate is elsewhere
+            coarse[max(0, y - ch // 2):y + ch // 2 + 1, max(0, x - cw // 2):x + cw // 2 + 1] = -1
+            y0, x0 = max(0, y * factor - factor), max(0, x * factor - factor)
+            window = frame[y0:y0 + template.height + 2 * factor, x0:x0 + template.width + 2 * factor]
+            scores = match_template(window, template.array)
+            if scores.size == 0:
+                continue
+            dy, dx = np.unravel_index(np.argmax(scores), scores.shape)
+            score = float(scores[dy, dx])
+            if score >= threshold and (best is None or score > best[4]):
+                best = (left + x0 + int(dx), top + y0 + int(dy), template.width, template.height, score)
+                if score >= MATCH_EXACT:
+                    break
+        return best
+
+matcher = TemplateMatcher()
+
+class FrameCapture:
+    """Screen frames in buffers reused from grab to grab, with per-tile change tracking
+
+    Every grab hashes each CAPTURE_TILE square and records the grab number in
+    which it last changed, so waiting code can ask whether anything in a region
+    changed without comparing pixels.
+    """
+    def __init__(self, tile=CAPTURE_TILE):
+        self.tile = tile
+        self.generation = 0
+        self.shape = None
+        self.converted = False
+
+    def allocate(self, shape):
+        rows, columns = -(-shape[0] // self.tile), -(-shape[1] // self.tile)
+        self.shape = shape
+        self.gray = np.zeros(shape, dtype=np.uint8)
+        self.padded = np.zeros((rows * self.tile, columns * self.tile), dtype=np.uint8)
+        self.pixels = np.zeros(shape, dtype=np.float32)
+        self.hashes = np.zeros((rows, columns), dtype=np.uint32)
+        self.scratch = np.zeros((rows, columns), dtype=np.uint32)
+        self.versions = np.zeros((rows, columns), dtype=np.int64)
+        # Multiply-and-sum with fixed random weights, wrapping in uint32, is a
+        # cheap vectorized hash of a tile
+        self.weights = np.random.default_rng(0).integers(1, 2 ** 32, (self.tile, self.tile), dtype=np.uint32)
+
+    def grab(self):
+        """Capture the screen once; all lookups until the next grab share it"""
+        image = pyautogui.screenshot().convert('L')
+        shape = (image.height, image.width)
+        if shape != self.shape:
+            self.allocate(shape)
+            self.versions[:] = self.generation + 1
+        np.copyto(self.gray, np.asarray(image))
+        self.padded[:shape[0], :shape[1]] = self.gray
+        rows, columns = self.hashes.shape
+        tiles = self.padded.reshape(rows, self.tile, columns, self.tile)
+        np.einsum('iajb,ab->ij', tiles, self.weights, out=self.scratch, dtype=np.uint32, casting='unsafe')
+
+        self.generation += 1
+        self.versions[self.scratch != self.hashes] = self.generation
+        self.hashes, self.scratch = self.scratch, self.hashes
+        self.converted = False
+        return self.generation
+
+    def frame(self):
+        """The last grab as float32 grayscale, converted at most once per grab"""
+        if not self.converted:
+            np.copyto(self.pixels, self.gray)
+            self.converted = True
+        return self.pixels
+
+    def tiles(self, region=None):
+        if region is None:
+            return self.versions
+        left, top, width, height = region
+        return self.versions[top // self.tile:(top + height - 1) // self.tile + 1,
+                             left // self.tile:(left + width - 1) // self.tile + 1]
+
+    def changed_tiles(self, since, region=None):
+        """How many tiles in region changed after grab number since"""
+        return int((self.tiles(region) > since).sum())
+
+    def crop(self, region):
+        """The last grab's grayscale pixels in region, as a view"""
+        left, top, width, height = region
+        return self.gray[top:top + height, left:left + width]
+
+    def changed_pixels(self, baseline, region):
+        """How many pixels in region differ from an earlier crop of it"""
+        current = self.crop(region)
+        if current.shape != baseline.shape:
+            return current.size
+        return int(np.count_nonzero(current != baseline))
+
+screen = FrameCapture()
+
+# Automation step runner
+#
+# automation_steps.json holds a list of steps, run in order on F8:
+#   [{"name": "Open form", "hotkey": ["ctrl", "l"]},
+#    {"name": "Go", "write": "{base_url}assessments/new\n", "wait": {"change": [0, 120, 1920, 900]}},
+#    {"name": "Job title", "wait": {"image": "job_title.png", "region": [0, 0, 1920, 600]}, "click": true},
+#    {"name": "Fill", "write": "{job_title}", "press": "tab", "timeout": 5}]
+# "image" waits happen before the step's action and "click": true clicks the
+# centre of the found image. "change" waits note the region before the action
+# and return once CHANGE_MIN_PIXELS of its pixels differ. Each step starts with
+# one screen grab that all of its lookups share; while waiting, lookups are
+# skipped until a tile in their region changes. Text may use {job_title} and
+# {base_url}.
+class StepTimeout(Exception):
+    pass
+
+class StepCancelled(Exception):
+    pass
+
+def load_steps(path=STEPS_FILE):
+    """Load the automation steps, or an empty list if there are none"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logging.warning(f"No automation steps found at {path}")
+        return []
+
+def load_settings():
+    """Read settings.json, or defaults if it does not exist yet"""
+    try:
+        with open('settings.json', 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'job_title': 'Technician'}
+
+class StepRunner:
+    """Runs automation steps, waiting on the screen instead of fixed sleeps"""
+    def __init__(self, steps, variables=None, cancelled=None):
+        self.steps = steps
+        self.variables = variables or {}
+        self.cancelled = cancelled or threading.Event()
+
+    def pause(self):
+        """Sleep between screen checks, returning early when the run is cancelled"""
+        if self.cancelled.wait(STEP_POLL_INTERVAL):
+            raise StepCancelled()
+
+    def wait_for_image(self, wait, deadline):
+        region = tuple(wait['region']) if wait.get('region') else None
+        checked = None
+        while True:
+            if checked is None or screen.changed_tiles(checked, region):
+                checked = screen.generation
+                found = matcher.locate(wait['image'], screen.frame(), region, wait.get('threshold', MATCH_THRESHOLD))
+                if found is not None:
+                    return found
+            if time.monotonic() >= deadline:
+                raise StepTimeout(f"{wait['image']} did not appear")
+            self.pause()
+            screen.grab()
+
+    def wait_for_change(self, region, before, baseline, deadline):
+        while True:
+            screen.grab()
+            # Tile hashes cheaply say whether anything in the region moved, the
+            # pixel count then tells a real change from a blinking caret
+            if screen.changed_tiles(before, region):
+                changed = screen.changed_pixels(baseline, region)
+                if changed >= CHANGE_MIN_PIXELS:
+                    return changed
+            if time.monotonic() >= deadline:
+                raise StepTimeout(f"Region {region} did not change")
+            self.pause()
+
+    def act(self, step, found):
+        if step.get('click'):
+            if step['click'] is True:
+                left, top, width, height, _ = found
+                pyautogui.click(left + width // 2, top + height // 2)
+            else:
+                pyautogui.click(*step['click'])
+        if 'write' in step:
+            pyautogui.write(step['write'].format(**self.variables))
+        if 'press' in step:
+            pyautogui.press(step['press'])
+        if 'hotkey' in step:
+            pyautogui.hotkey(*step['hotkey'])
+
+    def run_step(self, step):
+        wait = step.get('wait', {})
+        deadline = time.monotonic() + step.get('timeout', STEP_TIMEOUT)
+        if wait:
+            screen.grab()
+        found = self.wait_for_image(wait, deadline) if 'image' in wait else None
+        before = screen.generation
+        region = tuple(wait['change']) if 'change' in wait else None
+        baseline = screen.crop(region).copy() if region else None
+        self.act(step, found)
+        if region:
+            self.wait_for_change(region, before, baseline, deadline)
+
+    def run(self):
+        """Run every step, logging how long each took. Returns True if all finished."""
+        started = time.perf_counter()
+        for index, step in enumerate(self.steps, 1):
+            name = step.get('name', f"step {index}")
+            step_started = time.perf_counter()
+            try:
+                if self.cancelled.is_set():
+                    raise StepCancelled()
+                self.run_step(step)
+            except StepTimeout as e:
+                logging.error(f"Step {index} '{name}' timed out after "
+                              f"{time.perf_counter() - step_started:.2f}s: {str(e)}")
+                return False
+            except StepCancelled:
+                logging.info(f"Risk assessment cancelled at step {index} '{name}'")
+                return False
+            logging.info(f"Step {index} '{name}' took {(time.perf_counter() - step_started) * 1000:.0f} ms")
+        logging.info(f"Risk assessment finished in {time.perf_counter() - started:.2f}s ({len(self.steps)} steps)")
+        return True
+
+def run_automation(cancelled):
+    """Run the automation steps for the saved job title"""
+    variables = {'job_title': load_settings().get('job_title', 'Technician'), 'base_url': BASE_URL}
+    steps = load_steps()
+    # Decoded once on the first run, later runs find them cached
+    matcher.preload(step['wait']['image'] for step in steps if 'image' in step.get('wait', {}))
+    return StepRunner(steps, variables, cancelled).run()
+
+class AutomationDispatcher:
+    """Runs automations one at a time on a worker thread
+
+    Hotkey callbacks only hand over a request and return, so the keyboard hook
+    never blocks. Requests while a run is in progress, or repeats from a held
+    key, are dropped so pyautogui sequences never interleave.
+    """
+    def __init__(self, task=run_automation, debounce=HOTKEY_DEBOUNCE):
+        self.task = task
+        self.debounce = debounce
+        self.lock = threading.Lock()
+        self.requests = queue.Queue(maxsize=1)
+        self.cancelled = threading.Event()
+        self.running = False
+        self.last_request = 0
+        self.worker = None
+
+    def trigger(self):
+        """Ask for a run; returns False if it was dropped"""
+        now = time.monotonic()
+        with self.lock:
+            if self.running:
+                logging.info(f"Automation already running, press {CANCEL_HOTKEY} to cancel it")
+                return False
+            if now - self.last_request < self.debounce:
+                return False
+            self.last_request = now
+            self.running = True
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.work, daemon=True, name='automation')
+                self.worker.start()
+        self.requests.put_nowait(now)
+        return True
+
+    def cancel(self):
+        with self.lock:
+            if self.running:
+                logging.info("Cancelling the running automation")
+                self.cancelled.set()
+
+    def work(self):
+        while True:
+            self.requests.get()
+            self.cancelled.clear()
+            try:
+                self.task(self.cancelled)
+            except Exception as e:
+                logging.error(f"Automation failed: {str(e)}")
+            finally:
+                with self.lock:
+                    self.running = False
+
+dispatcher = AutomationDispatcher()
+
+def handle_hotkey():
+    """F8: start the automation unless one is already running"""
+    if HOTKEY_ENABLED:
+        dispatcher.trigger()
+
+def cancel_automation(icon=None, item=None):
+    """F9 or the tray menu: stop the running automation"""
+    dispatcher.cancel()
+
+def benchmark_imports(runs=5):
+    """Time cold starts in fresh interpreters and list the slowest imports (python -X importtime)"""
+    import subprocess
+    import statistics
+    scenarios = {
+        'resident': "import risk_assessment_tool",
+        'automation': "import risk_assessment_tool as t; t.np.zeros; t.pyautogui.size",
+        'setup GUI': "import risk_assessment_tool as t; t.ttk.Style; t.messagebox.showinfo",
+    }
+    for name, code in scenarios.items():
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                    cwd=APP_DIR, capture_output=True, text=True)
+            timings.append(time.perf_counter() - started)
+        if result.returncode != 0:
+            print(f"{name}: failed\n{result.stderr.strip().splitlines()[-1]}")
+            continue
+
+        # Top-level lines look like "import time:  self | cumulative | module"
+        imports = []
+        for line in result.stderr.splitlines():
+            fields = line.split('|')
+            if line.startswith('import time:') and len(fields) == 3 and not fields[2].startswith('  '):
+                cumulative = fields[1].strip()
+                if cumulative.isdigit():
+                    imports.append((int(cumulative), fields[2].strip()))
+        print(f"{name}: {statistics.median(timings) * 1000:.0f} ms median over {runs} runs "
+              f"(imports {sum(us for us, _ in imports) / 1000:.0f} ms)")
+        for cumulative, module in sorted(imports, reverse=True)[:8]:
+            print(f"  {cumulative / 1000:8.1f} ms  {module}")
+
 def main():
+    if '--resident' in sys.argv:
+        start_main_tool()
+        return
     if getattr(sys, 'frozen', False):
         app_path = os.path.join(os.getenv('APPDATA'), 'RiskAssessmentTool')
         if not os.path.exists(app_path):
@@ -241,6 +732,10 @@ def main():
         setup.root.mainloop()
 
 if __name__ == "__main__":
+    if '--benchmark-imports' in sys.argv:
+        benchmark_imports()
+        sys.exit()
+
     if not os.path.exists('images'):
         os.makedirs('images')
         logging.info('Created images directory')